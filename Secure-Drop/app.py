@@ -1,43 +1,161 @@
 import os
+import asyncio
+import base64
+import hashlib
+import hmac
+import queue
 import sqlite3
 import uuid
-import shutil
 import uvicorn
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
+from urllib.parse import quote
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 # --- Configuration ---
 UPLOAD_DIR = "secure_uploads"
 DB_FILE = "secure_drop.db"
+KEY_FILE = "secure_drop.key"  # master key, created on first run unless SECURE_DROP_KEY is set
 HOST = "localhost"
 PORT = 8000
 BASE_URL = f"http://{HOST}:{PORT}"
+DB_POOL_SIZE = 4  # SQLite connections shared by all requests
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, "partial")  # uploads in progress
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")  # finished uploads, named by a keyed hash of their content
+MAX_UPLOAD_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB per drop
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries and part headers allowed on top, for POST /upload
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # largest chunk accepted by PUT /uploads/{id}
+WRITE_BUFFER_BYTES = 1024 * 1024  # network reads are batched into writes this big
+ENCRYPTION_CHUNK_BYTES = 64 * 1024  # plaintext per authenticated chunk of a blob
+DROP_TTL = timedelta(days=7)  # drops nobody downloads are deleted after this
+UPLOAD_TTL = timedelta(days=1)  # unfinished chunked uploads are abandoned after this
+SWEEP_INTERVAL_SECONDS = 15 * 60
+SWEEP_BATCH_SIZE = 500  # drops deleted per transaction
+CLAIM_COOKIE = "drop_claim"  # lets the client that claimed a drop resume its download
 
-# Ensure upload directory exists
+# Ensure upload directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(PARTIAL_DIR, exist_ok=True)
+os.makedirs(BLOB_DIR, exist_ok=True)
 
 # --- Database Setup ---
+# Statements are kept as constants so each pooled connection prepares them
+# once and reuses them from its statement cache.
+SQL_INSERT_FILE = "INSERT INTO files (id, filename, filepath, uploaded_at) VALUES (?, ?, ?, ?)"
+SQL_SELECT_FILENAME = "SELECT filename FROM files WHERE id = ? AND (claim_token IS NULL OR claim_token = ?)"
+SQL_SELECT_FILE = "SELECT filename, filepath FROM files WHERE id = ? AND (claim_token IS NULL OR claim_token = ?)"
+# Claiming is a single conditional UPDATE, so when several workers race for
+# the same drop exactly one of them gets a row back.
+SQL_CLAIM_FILE = (
+    "UPDATE files SET claim_token = ? WHERE id = ? AND (claim_token IS NULL OR claim_token = ?) "
+    "RETURNING filename, filepath"
+)
+SQL_DELETE_FILE = "DELETE FROM files WHERE id = ?"
+SQL_COUNT_BLOB_LINKS = "SELECT COUNT(*) FROM files WHERE filepath = ?"
+SQL_INSERT_UPLOAD = "INSERT INTO uploads (id, filename, size, received, created_at) VALUES (?, ?, ?, 0, ?)"
+SQL_SELECT_UPLOAD = "SELECT filename, size, received FROM uploads WHERE id = ?"
+SQL_ADVANCE_UPLOAD = "UPDATE uploads SET received = ? WHERE id = ? AND received = ?"
+SQL_DELETE_UPLOAD = "DELETE FROM uploads WHERE id = ?"
+SQL_SELECT_EXPIRED_FILES = "SELECT id, filepath FROM files WHERE uploaded_at < ? ORDER BY uploaded_at LIMIT ?"
+SQL_SELECT_EXPIRED_UPLOADS = "SELECT id FROM uploads WHERE created_at < ? ORDER BY created_at LIMIT ?"
+
+class Database:
+    """
+    A fixed pool of SQLite connections in WAL mode. Queries run on worker
+    threads, so endpoints await them instead of blocking the event loop.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        # WAL lets readers carry on while a write is being committed.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def run_sync(self, work):
+        """Calls work(conn) on a pooled connection inside one transaction."""
+        conn = self._pool.get()
+        try:
+            with conn:  # commits, or rolls back if work raises
+                return work(conn)
+        finally:
+            self._pool.put(conn)
+
+    async def run(self, work):
+        return await asyncio.to_thread(self.run_sync, work)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def execute(self, sql, params=()):
+        """Runs one statement and returns the number of rows it changed."""
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
 def init_db():
     """Initialize the SQLite database to track files."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
+    db.run_sync(lambda conn: conn.executescript('''
         CREATE TABLE IF NOT EXISTS files (
             id TEXT PRIMARY KEY,
             filename TEXT,
             filepath TEXT,
-            uploaded_at TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+            uploaded_at TIMESTAMP,
+            claim_token TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_uploaded_at ON files (uploaded_at);
+        CREATE INDEX IF NOT EXISTS idx_files_filepath ON files (filepath);
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            size INTEGER,
+            received INTEGER,
+            created_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_uploads_created_at ON uploads (created_at);
+    '''))
+    # Databases created before drops could be claimed lack the column.
+    columns = db.run_sync(lambda conn: [row[1] for row in conn.execute("PRAGMA table_info(files)")])
+    if "claim_token" not in columns:
+        db.run_sync(lambda conn: conn.execute("ALTER TABLE files ADD COLUMN claim_token TEXT"))
 
+db = Database(DB_FILE)
 init_db()
 
 # --- FastAPI App ---
-app = FastAPI(title="Secure Drop")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(run_expiry_sweeper())
+    yield
+    sweeper.cancel()
+
+app = FastAPI(title="Secure Drop", lifespan=lifespan)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """
+    The form body of POST /upload is spooled to disk in full before
+    upload_file() runs, so a body that declares itself too large is turned
+    away here instead, before any of it is read.
+    """
+    if request.url.path == "/upload":
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse({"detail": "File is too large."}, status_code=413)
+    return await call_next(request)
 
 # --- HTML Templates (Embedded for Single-File Portability) ---
 # In a larger app, these would be in a /templates folder.
@@ -78,7 +196,7 @@ UPLOAD_PAGE_HTML = f"""
             <input type="file" id="fileInput" hidden>
         </div>
 
-        <div id="loading" class="hidden"><div class="spinner"></div><p>Encrypting & Uploading...</p></div>
+        <div id="loading" class="hidden"><div class="spinner"></div><p>Encrypting & Uploading... <span id="progress"></span></p></div>
 
         <div id="result" class="link-box">
             <p>Your self-destructing link:</p>
@@ -92,6 +210,8 @@ UPLOAD_PAGE_HTML = f"""
         const loading = document.getElementById('loading');
         const result = document.getElementById('result');
         const fileLink = document.getElementById('fileLink');
+        const progress = document.getElementById('progress');
+        const MAX_RETRIES = 5;
 
         dropZone.addEventListener('click', () => fileInput.click());
         dropZone.addEventListener('dragover', (e) => {{ e.preventDefault(); dropZone.style.borderColor = '#646cff'; }});
@@ -103,16 +223,56 @@ UPLOAD_PAGE_HTML = f"""
         }});
         fileInput.addEventListener('change', () => {{ if (fileInput.files.length) handleUpload(fileInput.files[0]); }});
 
+        async function postJson(url, body) {{
+            const res = await fetch(url, {{
+                method: 'POST',
+                headers: {{ 'Content-Type': 'application/json' }},
+                body: JSON.stringify(body || {{}})
+            }});
+            if (!res.ok) throw new Error((await res.json()).detail || res.statusText);
+            return res.json();
+        }}
+
+        // Sends the file in chunks. After a failed chunk it asks the server
+        // how much arrived and carries on from there.
+        async function uploadInChunks(file) {{
+            const upload = await postJson('/uploads', {{ filename: file.name, size: file.size }});
+            let offset = upload.offset;
+            let failures = 0;
+            while (offset < file.size) {{
+                progress.textContent = Math.floor(offset * 100 / file.size) + '%';
+                try {{
+                    const res = await fetch(`/uploads/${{upload.upload_id}}?offset=${{offset}}`, {{
+                        method: 'PUT',
+                        body: file.slice(offset, offset + upload.chunk_size)
+                    }});
+                    if (res.ok || res.status === 409) {{
+                        offset = (await res.json()).offset;
+                        failures = 0;
+                        continue;
+                    }}
+                    if (res.status < 500) throw new Error((await res.json()).detail);
+                }} catch (err) {{
+                    if (!(err instanceof TypeError)) throw err;  // TypeError: network failure
+                }}
+                if (++failures > MAX_RETRIES) throw new Error('Too many failed attempts');
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                try {{
+                    offset = (await (await fetch(`/uploads/${{upload.upload_id}}`)).json()).offset;
+                }} catch (err) {{
+                    // Still offline; the next attempt will tell.
+                }}
+            }}
+            return postJson(`/uploads/${{upload.upload_id}}/finalize`);
+        }}
+
         async function handleUpload(file) {{
             dropZone.classList.add('hidden');
             loading.classList.remove('hidden');
-            
-            const formData = new FormData();
-            formData.append('file', file);
+            progress.textContent = '';
 
             try {{
-                const res = await fetch('/upload', {{ method: 'POST', body: formData }});
-                const data = await res.json();
+                const data = await uploadInChunks(file);
                 
                 loading.classList.add('hidden');
                 result.style.display = 'block';
@@ -176,26 +336,354 @@ ERROR_PAGE_HTML = f"""
 </html>
 """
 
+# --- Blob Store ---
+# Identical uploads share one blob. A blob's reference count is the number of
+# rows in `files` pointing at it; linking and unlinking both run inside a
+# database transaction, so a blob can't be deleted while a new drop links it.
+def blob_path(digest: str):
+    """Fans blobs out over two directory levels to keep directories small."""
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest)
+
+def link_blob(conn, temp_path: str, digest: str, file_id: str, filename: str):
+    """
+    Records a drop for the finished upload at temp_path, moving it into the
+    blob store unless the same bytes are stored already. Call via db.run.
+    """
+    path = blob_path(digest)
+    conn.execute(SQL_INSERT_FILE, (file_id, filename, path, datetime.now()))
+    if os.path.exists(path) and is_sealed(path):
+        os.remove(temp_path)
+        print(f"[=] Upload deduplicated against blob {digest}")
+    else:
+        # A plaintext blob is never reused: the sealed upload replaces it,
+        # and drops already linking it read the same bytes back.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+def unlink_blob(conn, file_id: str, filepath: str):
+    """Deletes a drop's row, and its blob once no other drop links to it. Call via db.run."""
+    conn.execute(SQL_DELETE_FILE, (file_id,))
+    if conn.execute(SQL_COUNT_BLOB_LINKS, (filepath,)).fetchone()[0] > 0:
+        return False
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    return True
+
+# --- Encryption at Rest ---
+# A blob is a header (magic + random salt) followed by AES-GCM chunks of
+# ENCRYPTION_CHUNK_BYTES plaintext each. The blob's key is derived from the
+# master key and its salt. A chunk's nonce is its index plus a flag marking
+# the final chunk, so chunks can't be reordered or the blob truncated without
+# failing authentication. Any chunk decrypts on its own, which is what lets
+# Range requests skip straight to the bytes they ask for.
+BLOB_MAGIC = b"SDROPv1\0"
+SALT_BYTES = 16
+TAG_BYTES = 16
+BLOB_HEADER_BYTES = len(BLOB_MAGIC) + SALT_BYTES
+SEALED_CHUNK_BYTES = ENCRYPTION_CHUNK_BYTES + TAG_BYTES
+
+def load_master_key():
+    """Reads the key from SECURE_DROP_KEY (urlsafe base64) or KEY_FILE, creating the file on first run."""
+    if os.environ.get("SECURE_DROP_KEY"):
+        key = base64.urlsafe_b64decode(os.environ["SECURE_DROP_KEY"])
+    elif os.path.exists(KEY_FILE):
+        with open(KEY_FILE, "rb") as f:
+            key = f.read()
+    else:
+        key = os.urandom(32)
+        with os.fdopen(os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+            f.write(key)
+        print(f"[+] Generated a new encryption key in {KEY_FILE}")
+    if len(key) != 32:
+        raise RuntimeError("The Secure Drop encryption key must be 32 bytes.")
+    return key
+
+MASTER_KEY = load_master_key()
+
+def derive_key(salt: bytes, purpose: bytes):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=purpose).derive(MASTER_KEY)
+
+# Blobs are named by an HMAC of their plaintext rather than a bare SHA-256,
+# so the names on disk (and the ETags built from them) don't let anyone
+# without the key check whether a known file has been dropped.
+BLOB_NAME_KEY = derive_key(b"", b"blob name")
+
+def blob_digest():
+    """A fresh keyed hash for naming a blob; feed it the plaintext."""
+    return hmac.new(BLOB_NAME_KEY, digestmod=hashlib.sha256)
+
+def is_sealed(path: str):
+    """Whether the blob at path is encrypted, rather than stored before encryption was added."""
+    with open(path, "rb") as f:
+        return f.read(len(BLOB_MAGIC)) == BLOB_MAGIC
+
+def chunk_nonce(index: int, final: bool):
+    return index.to_bytes(11, "big") + (b"\1" if final else b"\0")
+
+class BlobWriter:
+    """Write-only file wrapper that encrypts everything written through it into a blob."""
+
+    def __init__(self, f):
+        self.f = f
+        salt = os.urandom(SALT_BYTES)
+        self.aead = AESGCM(derive_key(salt, b"blob"))
+        self.index = 0
+        self.pending = bytearray()
+        f.write(BLOB_MAGIC + salt)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        position = min(ENCRYPTION_CHUNK_BYTES - len(self.pending), len(view))
+        self.pending += view[:position]
+        # The pending chunk is only sealed once more data follows it: only
+        # close() knows which chunk is the final one.
+        while position < len(view):
+            self._seal(self.pending, final=False)
+            self.pending = bytearray(view[position:position + ENCRYPTION_CHUNK_BYTES])
+            position += ENCRYPTION_CHUNK_BYTES
+
+    def close(self):
+        self._seal(self.pending, final=True)
+        self.pending = bytearray()
+
+    def _seal(self, chunk, final: bool):
+        self.f.write(self.aead.encrypt(chunk_nonce(self.index, final), chunk, None))
+        self.index += 1
+
+class BlobReader:
+    """
+    Decrypts byte ranges of a blob, reading only the chunks they cover. Blobs
+    stored before encryption was added have no header and are read as-is.
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, "rb")
+        stored = os.fstat(self.f.fileno()).st_size
+        header = self.f.read(BLOB_HEADER_BYTES)
+        self.encrypted = len(header) == BLOB_HEADER_BYTES and header.startswith(BLOB_MAGIC)
+        if self.encrypted:
+            self.aead = AESGCM(derive_key(header[len(BLOB_MAGIC):], b"blob"))
+            self.chunks = -(-(stored - BLOB_HEADER_BYTES) // SEALED_CHUNK_BYTES)
+            self.size = stored - BLOB_HEADER_BYTES - self.chunks * TAG_BYTES
+        else:
+            self.size = stored
+
+    def read(self, start: int, end: int):
+        """Returns plaintext bytes [start, end)."""
+        if not self.encrypted:
+            self.f.seek(start)
+            return self.f.read(end - start)
+        first = start // ENCRYPTION_CHUNK_BYTES
+        last = (end - 1) // ENCRYPTION_CHUNK_BYTES
+        self.f.seek(BLOB_HEADER_BYTES + first * SEALED_CHUNK_BYTES)
+        chunks = []
+        for index in range(first, last + 1):
+            sealed = self.f.read(SEALED_CHUNK_BYTES)
+            chunks.append(self.aead.decrypt(chunk_nonce(index, index == self.chunks - 1), sealed, None))
+        # Only the first and last chunks can be partly outside the range.
+        chunks[-1] = chunks[-1][:end - last * ENCRYPTION_CHUNK_BYTES]
+        chunks[0] = chunks[0][start - first * ENCRYPTION_CHUNK_BYTES:]
+        return b"".join(chunks)
+
+    def close(self):
+        self.f.close()
+
+def blob_size(path: str):
+    """Plaintext size of a blob."""
+    reader = BlobReader(path)
+    reader.close()
+    return reader.size
+
+# Chunked uploads arrive over many requests and are written at offsets, so
+# until they are finalized they are kept under AES-CTR with a per-upload key,
+# whose keystream can start at any byte. Plaintext never reaches the disk.
+def partial_cipher(upload_id: str, offset: int):
+    """Returns an AES-CTR context positioned at byte `offset` of the upload."""
+    key = derive_key(upload_id.encode(), b"partial")
+    context = Cipher(algorithms.AES(key), modes.CTR((offset // 16).to_bytes(16, "big"))).encryptor()
+    context.update(bytes(offset % 16))
+    return context
+
+def write_partial(upload_id: str, offset: int, data: bytes):
+    """Encrypts data and writes it at a fixed position, so a chunk sent twice lands in the same place."""
+    with open(partial_path(upload_id), "r+b") as f:
+        f.seek(offset)
+        f.write(partial_cipher(upload_id, offset).update(data))
+
+def seal_partial(upload_id: str):
+    """
+    Re-encrypts a complete partial upload into blob format in one pass,
+    hashing the plaintext on the way. Returns (sealed temp path, blob name).
+    """
+    sealed_path = os.path.join(PARTIAL_DIR, f"{upload_id}.{uuid.uuid4().hex}.blob")
+    context = partial_cipher(upload_id, 0)
+    digest = blob_digest()
+    with open(partial_path(upload_id), "rb") as source, open(sealed_path, "wb") as target:
+        writer = BlobWriter(target)
+        while block := source.read(WRITE_BUFFER_BYTES):
+            write_hashed(writer, digest, context.update(block))
+        writer.close()
+    return sealed_path, digest.hexdigest()
+
+# --- Expiry Sweeper ---
+# Drops that are never downloaded, and chunked uploads that are never
+# finalized, would otherwise stay on disk forever. The sweeper walks the
+# uploaded_at / created_at indexes oldest first and removes a batch per
+# transaction, so it holds the write lock briefly and reuses one connection.
+def sweep_expired_files(conn, cutoff: datetime):
+    """Deletes one batch of expired drops. Returns (drops deleted, bytes reclaimed). Call via db.run."""
+    expired = conn.execute(SQL_SELECT_EXPIRED_FILES, (cutoff, SWEEP_BATCH_SIZE)).fetchall()
+    conn.executemany(SQL_DELETE_FILE, [(file_id,) for file_id, _ in expired])
+    reclaimed = 0
+    for filepath in {filepath for _, filepath in expired}:
+        # Blobs still linked by a newer drop stay.
+        if conn.execute(SQL_COUNT_BLOB_LINKS, (filepath,)).fetchone()[0] == 0 and os.path.exists(filepath):
+            reclaimed += os.path.getsize(filepath)
+            os.remove(filepath)
+    return len(expired), reclaimed
+
+def sweep_expired_uploads(conn, cutoff: datetime):
+    """Deletes one batch of abandoned chunked uploads. Returns (uploads deleted, bytes reclaimed). Call via db.run."""
+    expired = conn.execute(SQL_SELECT_EXPIRED_UPLOADS, (cutoff, SWEEP_BATCH_SIZE)).fetchall()
+    conn.executemany(SQL_DELETE_UPLOAD, expired)
+    reclaimed = 0
+    for (upload_id,) in expired:
+        path = partial_path(upload_id)
+        if os.path.exists(path):
+            reclaimed += os.path.getsize(path)
+            os.remove(path)
+    return len(expired), reclaimed
+
+async def sweep_expired():
+    """Runs both sweeps to completion, one batch per transaction, and reports what was freed."""
+    now = datetime.now()
+    totals = {}
+    for name, sweep, cutoff in (("drops", sweep_expired_files, now - DROP_TTL),
+                                ("uploads", sweep_expired_uploads, now - UPLOAD_TTL)):
+        count = reclaimed = 0
+        while True:
+            deleted, freed = await db.run(lambda conn: sweep(conn, cutoff))
+            count += deleted
+            reclaimed += freed
+            if deleted < SWEEP_BATCH_SIZE:
+                break
+        totals[name] = (count, reclaimed)
+        if count:
+            print(f"[-] Expired {count} {name}, reclaimed {reclaimed:,} bytes")
+    return totals
+
+async def run_expiry_sweeper():
+    while True:
+        try:
+            await sweep_expired()
+        except Exception as e:
+            print(f"Error during expiry sweep: {e}")
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
 # --- Helper Functions ---
-def cleanup_file(file_id: str, filepath: str):
-    """Deletes the file from disk and the database."""
+async def cleanup_file(file_id: str, filepath: str):
+    """Deletes the drop from the database, and its file once nothing else links to it."""
     try:
-        # 1. Delete from Disk
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        if await db.run(lambda conn: unlink_blob(conn, file_id, filepath)):
             print(f"[-] File deleted from disk: {filepath}")
-        
-        # 2. Delete from Database
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
-        conn.commit()
-        conn.close()
         print(f"[-] Record deleted from DB: {file_id}")
         
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
+def write_hashed(buffer, digest, data: bytes):
+    digest.update(data)
+    buffer.write(data)
+
+def partial_path(upload_id: str):
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+async def upload_or_404(upload_id: str):
+    upload = await db.fetchone(SQL_SELECT_UPLOAD, (upload_id,))
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found or already finalized.")
+    return upload
+
+def parse_byte_range(header: str, size: int):
+    """
+    Parses a single "bytes=" range into (start, end), end exclusive. Returns
+    None for anything else, including multiple ranges, which means the whole
+    file is sent instead, as RFC 9110 allows.
+    """
+    unit, _, spec = header.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or not dash or "," in spec:
+        return None
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= end or (first and last and int(last) < int(first)):
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+class DropResponse(Response):
+    """
+    Streams bytes [start, end) of a drop, decrypting as it goes, and runs its
+    background task (the self-destruct) only once the last byte of the file
+    has been sent. A download that dies halfway leaves the drop in place to be
+    resumed with a Range request.
+    """
+    media_type = "application/octet-stream"
+
+    def __init__(self, path: str, filename: str, etag: str, start: int, end: int, size: int, background=None):
+        self.path = path
+        self.start, self.end, self.size = start, end, size
+        self.background = background
+        headers = {"accept-ranges": "bytes", "etag": etag, "content-length": str(end - start)}
+        quoted = quote(filename)
+        if quoted != filename:
+            headers["content-disposition"] = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            headers["content-disposition"] = f'attachment; filename="{filename}"'
+        if (start, end) == (0, size):
+            self.status_code = 200
+        else:
+            self.status_code = 206
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        reader = await asyncio.to_thread(BlobReader, self.path)
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            position = self.start
+            more_body = True
+            while more_body:
+                if disconnected.is_set():
+                    return  # interrupted: keep the drop so it can be resumed
+                block_end = min(position + WRITE_BUFFER_BYTES, self.end)
+                body = await asyncio.to_thread(reader.read, position, block_end) if block_end > position else b""
+                position = block_end
+                more_body = position < self.end
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+        finally:
+            watcher.cancel()
+            await asyncio.to_thread(reader.close)
+
+        if self.background is not None and self.end == self.size:
+            await self.background()
+
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+
 # --- Endpoints ---
 
 @app.get("/", response_class=HTMLResponse)
@@ -207,34 +695,112 @@ async def home():
 async def upload_file(file: UploadFile = File(...)):
     """Handle file upload and generate link."""
     file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    save_name = f"{file_id}{file_ext}"
-    file_path = os.path.join(UPLOAD_DIR, save_name)
-
-    # Save content to disk
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Save metadata to DB
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO files (id, filename, filepath, uploaded_at) VALUES (?, ?, ?, ?)",
-        (file_id, file.filename, file_path, datetime.now())
-    )
-    conn.commit()
-    conn.close()
+    temp_path = partial_path(file_id)
+
+    # Encrypt content to disk off the event loop, hashing the plaintext on the way
+    size = 0
+    digest = blob_digest()
+    try:
+        with open(temp_path, "wb") as buffer:
+            writer = BlobWriter(buffer)
+            while chunk := await file.read(WRITE_BUFFER_BYTES):
+                size += len(chunk)
+                # Exact limit. A body sent without Content-Length only gets
+                # here after it has been spooled, whatever its size.
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File is too large.")
+                await asyncio.to_thread(write_hashed, writer, digest, chunk)
+            writer.close()
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    # Save metadata to DB and move the content into the blob store
+    await db.run(lambda conn: link_blob(conn, temp_path, digest.hexdigest(), file_id, file.filename))
 
     return {"url": f"{BASE_URL}/d/{file_id}"}
 
+@app.post("/uploads")
+async def init_upload(upload: UploadInit):
+    """Start a chunked upload. Chunks are then PUT in order and the upload finalized."""
+    if upload.size < 0 or upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File is too large.")
+    upload_id = str(uuid.uuid4())
+    await asyncio.to_thread(lambda: open(partial_path(upload_id), "wb").close())
+    await db.execute(SQL_INSERT_UPLOAD, (upload_id, upload.filename, upload.size, datetime.now()))
+    return {"upload_id": upload_id, "offset": 0, "size": upload.size, "chunk_size": UPLOAD_CHUNK_BYTES}
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """How many bytes have arrived; a client resumes from this offset."""
+    _, size, received = await upload_or_404(upload_id)
+    return {"upload_id": upload_id, "offset": received, "size": size}
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Append the request body at `offset`, which must equal the bytes received so far."""
+    _, size, received = await upload_or_404(upload_id)
+    if offset != received:
+        return JSONResponse(
+            {"detail": "Offset does not match the bytes received so far.", "offset": received, "size": size},
+            status_code=409
+        )
+
+    written = 0
+    pending = bytearray()
+    try:
+        async for data in request.stream():
+            if len(pending) + written + len(data) > min(UPLOAD_CHUNK_BYTES, size - offset):
+                raise HTTPException(status_code=413, detail="Chunk is too large or goes past the declared size.")
+            pending += data
+            if len(pending) >= WRITE_BUFFER_BYTES:
+                await asyncio.to_thread(write_partial, upload_id, offset + written, bytes(pending))
+                written += len(pending)
+                pending.clear()
+    except ClientDisconnect:
+        # Keep whatever arrived; the client resumes from the new offset.
+        pass
+    if pending:
+        await asyncio.to_thread(write_partial, upload_id, offset + written, bytes(pending))
+        written += len(pending)
+
+    # Only moves forward from the offset this chunk was written at, so a
+    # concurrent duplicate of the same chunk can't double-count it.
+    if await db.execute(SQL_ADVANCE_UPLOAD, (offset + written, upload_id, offset)) == 0:
+        _, size, received = await upload_or_404(upload_id)
+        return JSONResponse(
+            {"detail": "Another request already wrote this chunk.", "offset": received, "size": size},
+            status_code=409
+        )
+    return {"upload_id": upload_id, "offset": offset + written, "size": size}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """Turn a complete chunked upload into a drop and return its link."""
+    filename, size, received = await upload_or_404(upload_id)
+    if received != size:
+        raise HTTPException(status_code=409, detail=f"Only {received} of {size} bytes have been received.")
+    # Chunks may arrive over many requests, so the content is hashed once
+    # here, while it is re-encrypted into blob format.
+    sealed_path, digest = await asyncio.to_thread(seal_partial, upload_id)
+
+    def finalize(conn):
+        # Whoever deletes the upload row owns the partial file.
+        if conn.execute(SQL_DELETE_UPLOAD, (upload_id,)).rowcount == 0:
+            os.remove(sealed_path)
+            return False
+        link_blob(conn, sealed_path, digest, upload_id, filename)
+        os.remove(partial_path(upload_id))
+        return True
+
+    if not await db.run(finalize):
+        raise HTTPException(status_code=404, detail="Upload not found or already finalized.")
+    return {"url": f"{BASE_URL}/d/{upload_id}"}
+
 @app.get("/d/{file_id}", response_class=HTMLResponse)
-async def download_landing(file_id: str):
+async def download_landing(file_id: str, request: Request):
     """Show the 'Click to Download' landing page."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT filename FROM files WHERE id = ?", (file_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = await db.fetchone(SQL_SELECT_FILENAME, (file_id, request.cookies.get(CLAIM_COOKIE)))
 
     if not result:
         return HTMLResponse(content=ERROR_PAGE_HTML, status_code=404)
@@ -242,27 +808,39 @@ async def download_landing(file_id: str):
     return HTMLResponse(content=DOWNLOAD_PAGE_HTML)
 
 @app.get("/d/{file_id}/stream")
-async def download_stream(file_id: str, background_tasks: BackgroundTasks):
-    """Actually serve the file and trigger self-destruction."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT filename, filepath FROM files WHERE id = ?", (file_id,))
-    result = cursor.fetchone()
-    conn.close()
+async def download_stream(file_id: str, request: Request, background_tasks: BackgroundTasks):
+    """Actually serve the file (Range requests supported) and self-destruct once all of it is sent."""
+    claim_token = request.cookies.get(CLAIM_COOKIE) or uuid.uuid4().hex
+    result = await db.fetchone(SQL_SELECT_FILE, (file_id, claim_token))
 
     if not result:
         return HTMLResponse(content=ERROR_PAGE_HTML, status_code=404)
 
     filename, filepath = result
+    size = await asyncio.to_thread(blob_size, filepath)
+
+    # A blob's name is a hash of its content, which makes a strong ETag for If-Range.
+    etag = f'"{os.path.basename(filepath)}"'
+    start, end = 0, size
+    http_range = request.headers.get("range")
+    if http_range and request.headers.get("if-range", etag) == etag:
+        start, end = parse_byte_range(http_range, size) or (0, size)
+
+    # Only claim the drop once the request is known to be servable, so a bad
+    # Range or an unreadable blob doesn't lock everyone out. From then on only
+    # the same client may come back for the rest of it, whichever worker
+    # process on this host it lands on. (SQLite's WAL mode needs shared
+    # memory, so the database can't live on a network filesystem and the
+    # claim doesn't extend across hosts.)
+    if not await db.fetchone(SQL_CLAIM_FILE, (claim_token, file_id, claim_token)):
+        return HTMLResponse(content=ERROR_PAGE_HTML, status_code=404)
 
-    # Schedule the cleanup task to run AFTER the response is sent
+    # Schedule the cleanup task to run AFTER the last byte is sent
     background_tasks.add_task(cleanup_file, file_id, filepath)
 
-    return FileResponse(
-        path=filepath, 
-        filename=filename,
-        media_type='application/octet-stream'
-    )
+    response = DropResponse(filepath, filename, etag, start, end, size, background=background_tasks)
+    response.set_cookie(CLAIM_COOKIE, claim_token, path=f"/d/{file_id}", httponly=True, samesite="lax")
+    return response
 
 if __name__ == "__main__":
     print(f"Server starting on {BASE_URL}")
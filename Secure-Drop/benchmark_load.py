@@ -0,0 +1,249 @@
+"""
+Drives a mixed workload of uploads, landing-page hits and one-time downloads
+against Secure Drop and reports per-operation latency, throughput and how
+long the server's event loop was blocked.
+
+Usage:
+    python benchmark_load.py [--concurrency 32] [--operations 2000]
+                             [--size-kb 256] [--mix upload=1,landing=2,download=1]
+                             [--url http://localhost:8000]
+
+By default the app is started under uvicorn in a child process, which also
+times its own event loop, so the lag figure covers stalls in the server and
+not in this client. With --url the requests go to a running server instead
+and loop lag isn't reported.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LAG_INTERVAL = 0.005  # how often the loop monitor expects to wake up
+LAG_THRESHOLD = 0.001  # wakeups later than this count as blocked time
+SERVER_START_TIMEOUT = 30  # seconds
+
+class LoopMonitor:
+    """Records how late a periodic timer fires: time the loop spent blocked."""
+
+    def __init__(self):
+        self.stalls = []  # (time.monotonic() on waking, lag)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            now = time.monotonic()
+            lag = now - start - LAG_INTERVAL
+            if lag > LAG_THRESHOLD:
+                self.stalls.append((now, lag))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def summary(self, start, end):
+        """Returns (blocked, worst stall) in seconds between two time.monotonic() readings."""
+        lags = [lag for at, lag in self.stalls if start <= at <= end]
+        return sum(lags), max(lags, default=0.0)
+
+def serve(work_dir, port, conn):
+    """
+    Child process: runs the app under uvicorn with a LoopMonitor on its loop.
+    Waits for the parent to send the timed (start, end) window, then shuts
+    down and sends back the loop figures for that window.
+    """
+    # The database, key file and blob store are created next to wherever the
+    # app is imported from; here that is the benchmark's scratch dir.
+    os.chdir(work_dir)
+    sys.path.insert(0, HERE)
+    # The app logs every drop; keep that out of the report.
+    sys.stdout = open(os.devnull, 'w')
+    import app
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app.app, host='127.0.0.1', port=port, log_level='warning'))
+    monitor = LoopMonitor()
+    window = []
+
+    def stop_when_told():
+        window.extend(conn.recv())
+        server.should_exit = True
+
+    async def watched():
+        monitor.start()
+        await server.serve()
+
+    threading.Thread(target=stop_when_told, daemon=True).start()
+    asyncio.run(watched())
+    conn.send(monitor.summary(*window))
+
+def drop_id(response):
+    response.raise_for_status()
+    return response.json()["url"].rsplit("/", 1)[1]
+
+class Workload:
+    """
+    Runs operations against the app. Drops for landing-page hits and
+    downloads are uploaded beforehand, enough that every planned download
+    has one to consume. Every upload sends different bytes, so each one is
+    hashed, encrypted and written as a new blob instead of deduplicated.
+    """
+
+    def __init__(self, client, payload):
+        self.client = client
+        self.payload = payload
+        self.landing_ids = []
+        self.download_ids = []
+        self.transferred = 0
+
+    def unique_payload(self):
+        return uuid.uuid4().bytes + self.payload[16:]
+
+    async def upload(self):
+        response = await self.client.post("/upload", files={"file": ("bench.bin", self.unique_payload())})
+        self.download_ids.append(drop_id(response))
+        self.transferred += len(self.payload)
+
+    async def landing(self):
+        response = await self.client.get(f"/d/{random.choice(self.landing_ids)}")
+        response.raise_for_status()
+
+    async def download(self):
+        response = await self.client.get(f"/d/{self.download_ids.pop()}/stream")
+        response.raise_for_status()
+        self.transferred += len(response.content)
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("upload", "landing", "download"):
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'.")
+        mix[name] = float(weight or 1)
+    return mix
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+async def run(base_url, args):
+    """Runs the workload and prints its figures. Returns the timed window as time.monotonic() readings."""
+    payload = os.urandom(args.size_kb * 1024)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        workload = Workload(client, payload)
+        weights = args.mix
+        planned = random.choices(list(weights), weights=list(weights.values()), k=args.operations)
+
+        # Seed drops outside the timed run.
+        seed = max(args.concurrency, planned.count("download"))
+        for _ in range(args.concurrency):
+            seed_payload = workload.unique_payload()
+            workload.landing_ids.append(drop_id(await client.post("/upload", files={"file": ("seed.bin", seed_payload)})))
+        await asyncio.gather(*(workload.upload() for _ in range(seed)))
+        workload.transferred = 0
+
+        latencies = {name: [] for name in weights}
+        failures = 0
+        pending = iter(planned)
+
+        async def worker():
+            nonlocal failures
+            for name in pending:
+                start = time.perf_counter()
+                try:
+                    await getattr(workload, name)()
+                except httpx.HTTPError:
+                    failures += 1
+                    continue
+                latencies[name].append(time.perf_counter() - start)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        finished = time.monotonic()
+
+    elapsed = finished - started
+    done = sum(len(values) for values in latencies.values())
+    print(f"{done} operations in {elapsed:.2f} s at concurrency {args.concurrency}, {args.size_kb} KB files, {failures} failed")
+    for name, values in latencies.items():
+        if values:
+            print(
+                f"{name:<9} {len(values):6d} ops | "
+                f"p50 {statistics.median(values) * 1000:8.1f} ms | "
+                f"p99 {percentile(values, 0.99) * 1000:8.1f} ms | "
+                f"max {max(values) * 1000:8.1f} ms"
+            )
+    print(f"throughput {done / elapsed:8.1f} ops/s | {workload.transferred / (1024 * 1024) / elapsed:8.1f} MB/s")
+    return started, finished
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(base_url, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return
+        except httpx.TransportError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("The benchmark server did not start.")
+            time.sleep(0.1)
+
+def run_local(args):
+    work_dir = tempfile.mkdtemp(prefix='secure-drop-load-')
+    os.environ['SECURE_DROP_KEY'] = base64.urlsafe_b64encode(os.urandom(32)).decode()
+    port = free_port()
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, args=(work_dir, port, child_conn), daemon=True)
+    process.start()
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url, process)
+        started, finished = asyncio.run(run(base_url, args))
+        conn.send((started, finished))
+        blocked, worst = conn.recv()
+        elapsed = finished - started
+        print(
+            f"server loop blocked {blocked * 1000:.0f} ms ({blocked / elapsed * 100:.1f}%), "
+            f"worst stall {worst * 1000:.1f} ms"
+        )
+        process.join()
+    finally:
+        with contextlib.suppress(Exception):
+            process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=32, help='operations in flight at once')
+    parser.add_argument('--operations', type=int, default=2000, help='operations in the timed run')
+    parser.add_argument('--size-kb', type=int, default=256, help='size of each uploaded file')
+    parser.add_argument('--mix', type=parse_mix, default='upload=1,landing=2,download=1', help='relative weight of each operation')
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the operation mix')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    if args.url:
+        asyncio.run(run(args.url, args))
+    else:
+        run_local(args)
+
+if __name__ == '__main__':
+    main()
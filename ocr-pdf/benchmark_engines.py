@@ -0,0 +1,102 @@
+"""
+Compares the tesseract CLI against the pooled in-process engines used by
+sever.py, and the path the server itself picks for each renderer.
+
+Usage:
+    python benchmark_engines.py sample.pdf [--language eng] [--pages 10] [--threads N]
+
+Each mode first OCRs the pages one at a time, for per-page latency, then
+all at once on --threads threads (OCR_WORKERS by default), as the server's
+OCR pool does. The parallel speedup shows whether a mode really runs pages
+side by side: one that holds the GIL while it works stays near 1x however
+many threads it gets. Requires tesserocr for the in-process mode.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def summarize(name, timings, wall, threads):
+    """Prints cold (first page) and warm latency in milliseconds, then parallel throughput."""
+    warm = timings[1:] or timings
+    print(
+        f"{name:<11} first page {timings[0] * 1000:8.1f} ms | "
+        f"warm p50 {statistics.median(warm) * 1000:8.1f} ms | "
+        f"max {max(warm) * 1000:8.1f} ms | "
+        f"{threads} threads {len(timings) / wall:6.2f} pages/s ({sum(timings) / wall:4.1f}x)"
+    )
+
+def ocr_one(run_page, image, work_dir, language, renderer):
+    output_base = os.path.join(work_dir, f'bench_{image.page:05d}')
+    start = time.perf_counter()
+    result = run_page(image, output_base, language, renderer)
+    elapsed = time.perf_counter() - start
+    output_path = f'{output_base}.{renderer}'
+    if result is False or not os.path.exists(output_path):
+        raise RuntimeError(f"No {renderer.upper()} produced for page {image.page}.")
+    os.remove(output_path)
+    return elapsed
+
+def time_pages(run_page, images, work_dir, language, renderer):
+    """Per-page seconds, OCR'ing one page after another."""
+    return [ocr_one(run_page, image, work_dir, language, renderer) for image in images]
+
+def time_parallel(run_page, images, work_dir, language, renderer, threads):
+    """Wall-clock seconds to OCR all pages on `threads` threads."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda image: ocr_one(run_page, image, work_dir, language, renderer), images))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdf', help='PDF to rasterize and OCR')
+    parser.add_argument('--language', default='eng')
+    parser.add_argument('--pages', type=int, default=10, help='number of pages to OCR per mode')
+    parser.add_argument('--threads', type=int, help='threads for the parallel run (default: OCR_WORKERS)')
+    args = parser.parse_args()
+    pdf_path = os.path.abspath(args.pdf)
+
+    work_dir = tempfile.mkdtemp(prefix='ocr-bench-')
+    try:
+        # sever.py makes its uploads/ and ocr_cache/ folders in the working
+        # directory on import. With no prewarming and no page cache, the
+        # first in-process page pays for loading its engine, and every page
+        # is really OCR'd.
+        os.chdir(work_dir)
+        sys.path.insert(0, HERE)
+        os.environ['OCR_PREWARM_LANGUAGES'] = ''
+        os.environ['OCR_CACHE_MAX_BYTES'] = '0'
+        import sever
+
+        threads = args.threads or sever.OCR_WORKERS
+        doc = sever.open_pdf(pdf_path, os.path.basename(pdf_path))
+        images = sever.render_page_chunk(doc, 1, min(args.pages, doc.page_count))
+        doc.close()
+        print(f"OCR'ing {len(images)} pages, language '{args.language}'.")
+
+        cli = lambda image, output_base, language, renderer: sever.run_tesseract_cli(image, output_base, language, renderer)
+        engine = lambda image, output_base, language, renderer: sever.run_tesseract_engine(image, output_base, language)
+        modes = [('cli pdf', cli, 'pdf'), ('cli tsv', cli, 'tsv')]
+        if sever.engine_pool is None:
+            print('engine tsv  skipped: tesserocr is not installed or OCR_ENGINE is not "auto".')
+        else:
+            modes.append(('engine tsv', engine, 'tsv'))
+        # What the server actually runs for each renderer.
+        modes += [('server pdf', sever.ocr_page, 'pdf'), ('server tsv', sever.ocr_page, 'tsv')]
+        for name, run_page, renderer in modes:
+            timings = time_pages(run_page, images, work_dir, args.language, renderer)
+            wall = time_parallel(run_page, images, work_dir, args.language, renderer, threads)
+            summarize(name, timings, wall, threads)
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,33 @@
 import os
+import hashlib
+import html
+import json
+import re
+import shutil
 import subprocess
 import tempfile
-from flask import Flask, request, jsonify, send_from_directory, send_file
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+import fitz  # PyMuPDF
+
+# Each OCR worker owns one core; stop Tesseract from spawning its own OpenMP
+# threads on top of that. Must be set before libtesseract is loaded.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+# Optional: in-process Tesseract bindings. Without them every page is OCR'd
+# by spawning the `tesseract` CLI.
+try:
+    import tesserocr
+    from PIL import Image
+except ImportError:
+    tesserocr = None
 
 # --- Flask App Initialization ---
 print("Flask server is starting up...")
@@ -14,7 +38,91 @@ CORS(app, expose_headers='Content-Disposition')
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB limit
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 200)) * 1024 * 1024
+SYNC_MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10 MB limit for the blocking /ocr endpoint
+
+# Background jobs live in memory, so run a single server process with
+# several threads. Leftover job files from a previous run are discarded.
+JOB_FOLDER = os.path.abspath(os.path.join(UPLOAD_FOLDER, 'jobs'))
+shutil.rmtree(JOB_FOLDER, ignore_errors=True)
+os.makedirs(JOB_FOLDER, exist_ok=True)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 60 * 60))  # seconds
+SSE_KEEPALIVE_SECONDS = 15
+
+# One Tesseract process per core. The pool is shared by all requests so that
+# concurrent uploads cannot oversubscribe the machine.
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+# Jobs wait on the OCR pool, so they need their own threads to avoid deadlock.
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='ocr-job')
+
+# Pages are rasterized this many at a time. At most two chunks of page images
+# are held in memory at once: the one being OCR'd and the one being rendered.
+RENDER_CHUNK_PAGES = int(os.environ.get('RENDER_CHUNK_PAGES', OCR_WORKERS))
+# Rasterization resolution; 150 matches what pdftoppm used by default.
+RENDER_DPI = int(os.environ.get('RENDER_DPI', 150))
+# Adaptive resolution: pages are OCR'd at ADAPTIVE_LOW_DPI first and only
+# re-rendered at ADAPTIVE_HIGH_DPI when Tesseract's mean word confidence
+# (0-100) comes out below ADAPTIVE_MIN_CONFIDENCE. Off unless requested.
+ADAPTIVE_OCR = os.environ.get('OCR_ADAPTIVE', 'false').lower() == 'true'
+ADAPTIVE_LOW_DPI = int(os.environ.get('ADAPTIVE_LOW_DPI', 100))
+ADAPTIVE_HIGH_DPI = int(os.environ.get('ADAPTIVE_HIGH_DPI', 300))
+ADAPTIVE_MIN_CONFIDENCE = float(os.environ.get('ADAPTIVE_MIN_CONFIDENCE', 80))
+
+# PyMuPDF must not be used from several threads at once, even on different
+# documents, so every fitz call in this module holds this lock.
+fitz_lock = threading.RLock()
+
+# A page with at least this many non-whitespace characters in its existing
+# text layer is treated as already searchable and passed through untouched.
+MIN_TEXT_LAYER_CHARS = int(os.environ.get('MIN_TEXT_LAYER_CHARS', 20))
+
+# On-disk cache of OCR'd pages, keyed by upload hash, language and page.
+# Set OCR_CACHE_MAX_BYTES to 0 to disable it.
+OCR_CACHE_DIR = os.environ.get('OCR_CACHE_DIR', 'ocr_cache')
+OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# 'auto' reads word boxes (tsv) from warm in-process engines when tesserocr
+# is installed; 'cli' always spawns the tesseract binary. Searchable PDF
+# pages always come from the CLI: tesserocr holds the GIL for the whole of
+# ProcessPages, which would leave one page OCR'd at a time per process and
+# stall every request thread meanwhile, while GetTSVText releases it.
+OCR_ENGINE = os.environ.get('OCR_ENGINE', 'auto')
+# 'image' replaces each OCR'd page with Tesseract's rendering of the page
+# image plus invisible text. 'graft' keeps the original page untouched and
+# only adds an invisible text layer, which keeps files small.
+OUTPUT_MODES = ('image', 'graft')
+DEFAULT_OUTPUT_MODE = os.environ.get('OCR_OUTPUT_MODE', 'image')
+# Tesseract output format needed by each output mode.
+MODE_RENDERERS = {'image': 'pdf', 'graft': 'tsv'}
+# Grafted text uses PDF reference fonts for CJK scripts and an embedded
+# Helvetica (Latin, Greek and Cyrillic) for everything else.
+GRAFT_CJK_FONTS = {'chi_sim': 'china-s', 'chi_tra': 'china-t', 'jpn': 'japan', 'kor': 'korea'}
+# Besides a searchable PDF, /ocr can return just the text as one of these
+# sidecar formats (mimetype, file extension), streamed page by page.
+SIDECAR_FORMATS = {
+    'txt': ('text/plain', '.txt'),
+    'hocr': ('text/html', '.hocr'),
+    'tsv': ('text/tab-separated-values', '.tsv'),
+    'json': ('application/json', '.json'),
+}
+OUTPUT_FORMATS = ('pdf', *SIDECAR_FORMATS)
+
+# Image-mode compression. Renders that are already almost pure black and
+# white (at most BILEVEL_MAX_MIDTONES of their pixels grey) are binarized,
+# which Tesseract stores as CCITT G4 instead of JPEG; 0 disables this.
+# Other pages are JPEGs at OUTPUT_JPEG_QUALITY, downsampled to
+# OUTPUT_IMAGE_MAX_DPI when they were OCR'd at a higher resolution.
+BILEVEL_MAX_MIDTONES = float(os.environ.get('BILEVEL_MAX_MIDTONES', 0.02))
+OUTPUT_JPEG_QUALITY = int(os.environ.get('OUTPUT_JPEG_QUALITY', 75))
+OUTPUT_IMAGE_MAX_DPI = int(os.environ.get('OUTPUT_IMAGE_MAX_DPI', 150))
+
+# Languages whose engines are loaded at startup instead of on first use.
+OCR_PREWARM_LANGUAGES = [lang for lang in os.environ.get('OCR_PREWARM_LANGUAGES', 'eng').split(',') if lang]
+# Idle engines kept across all languages; each holds its traineddata in
+# memory, so the least recently used languages are closed beyond this.
+OCR_ENGINE_MAX_IDLE = int(os.environ.get('OCR_ENGINE_MAX_IDLE', 2 * OCR_WORKERS))
 
 # --- Language Detection and Mapping ---
 def get_installed_languages():
@@ -50,6 +158,1156 @@ def get_installed_languages():
 
 SUPPORTED_LANGUAGES = get_installed_languages()
 
+# --- OCR Result Cache ---
+class PageCache:
+    """
+    Content-addressed store of per-page OCR output (one-page PDFs or TSV
+    word boxes) with a size budget.
+    Entries are evicted least-recently-used first. Files are written
+    atomically, so several server processes may share the same directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> size, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load(self):
+        """Rebuilds the LRU order from the files already on disk."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._size += size
+        self._remove(self._evict())
+
+    def _path(self, file_hash, language, page, kind):
+        # Fan out on the hash prefix to keep directories small.
+        return os.path.join(self.directory, file_hash[:2], f'{file_hash}_{language}_{page:05d}.{kind}')
+
+    def _evict(self):
+        """Drops entries over budget and returns their paths. Call with the lock held."""
+        evicted = []
+        while self._size > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+            evicted.append(path)
+        return evicted
+
+    @staticmethod
+    def _remove(paths):
+        # File I/O stays outside the lock, so hits aren't held up behind it.
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, file_hash, language, page, kind, destination):
+        """Copies a cached page to destination. Returns False on a miss."""
+        if not self.enabled:
+            return False
+        path = self._path(file_hash, language, page, kind)
+        # Once open, the file can be copied without the lock: evicting it
+        # only unlinks the name.
+        try:
+            source = open(path, 'rb')
+        except FileNotFoundError:
+            # Evicted, possibly by another process.
+            with self._lock:
+                self._size -= self._entries.pop(path, 0)
+                self.misses += 1
+            return False
+        with source:
+            with self._lock:
+                if path not in self._entries and os.path.exists(path):
+                    # Written by another process sharing the directory (not
+                    # just evicted here since it was opened).
+                    self._entries[path] = os.fstat(source.fileno()).st_size
+                    self._size += self._entries[path]
+                if path in self._entries:
+                    self._entries.move_to_end(path)
+                self.hits += 1
+            with open(destination, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        try:
+            os.utime(path)  # keeps the LRU order for the next _load()
+        except FileNotFoundError:
+            pass
+        return True
+
+    def put(self, file_hash, language, page, kind, source):
+        """Stores a page's OCR output and evicts old entries if needed."""
+        if not self.enabled:
+            return
+        path = self._path(file_hash, language, page, kind)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(source, temp_path)
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            # A full or read-only cache must never fail the OCR request itself.
+            print(f"Warning: could not write to the OCR cache: {e}")
+            return
+        with self._lock:
+            self._size += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            evicted = self._evict()
+        self._remove(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+page_cache = PageCache(OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES)
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a file on disk."""
+    hash_sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+# --- Tesseract Engines ---
+class TesseractEnginePool:
+    """
+    Keeps initialised tesserocr handles per language so the traineddata is
+    loaded once per worker rather than once per page. A handle is only used
+    by one thread at a time. At most max_idle handles are kept between
+    pages; past that, handles of the least recently used language are
+    closed first.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = OrderedDict()  # language -> [PyTessBaseAPI], least recently used first
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _create(self, language):
+        return tesserocr.PyTessBaseAPI(lang=language)
+
+    @contextmanager
+    def borrow(self, language):
+        api = None
+        with self._lock:
+            idle = self._idle.get(language)
+            if idle:
+                api = idle.pop()
+                self._count -= 1
+                if not idle:
+                    del self._idle[language]
+        if api is None:
+            api = self._create(language)
+        try:
+            yield api
+        except Exception:
+            # Don't hand a handle in an unknown state to the next page.
+            api.End()
+            raise
+        self._put(language, [api])
+
+    def prewarm(self, language, count):
+        self._put(language, [self._create(language) for _ in range(count)])
+
+    def _put(self, language, apis):
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(language, []).extend(apis)
+            self._idle.move_to_end(language)
+            self._count += len(apis)
+            while self._count > self.max_idle:
+                oldest, idle = next(iter(self._idle.items()))
+                evicted.append(idle.pop())
+                self._count -= 1
+                if not idle:
+                    del self._idle[oldest]
+        for api in evicted:
+            api.End()
+
+engine_pool = TesseractEnginePool(OCR_ENGINE_MAX_IDLE) if tesserocr is not None and OCR_ENGINE == 'auto' else None
+
+def prewarm_engines():
+    for language in OCR_PREWARM_LANGUAGES:
+        if language not in SUPPORTED_LANGUAGES:
+            continue
+        try:
+            engine_pool.prewarm(language, OCR_WORKERS)
+            print(f"Loaded {OCR_WORKERS} in-process Tesseract engines for '{language}'.")
+        except RuntimeError as e:
+            print(f"Warning: could not prewarm Tesseract engines for '{language}': {e}")
+
+if engine_pool is not None:
+    # Pages OCR'd before this finishes just load engines of their own.
+    threading.Thread(target=prewarm_engines, name='ocr-prewarm', daemon=True).start()
+else:
+    print("In-process Tesseract engines unavailable; using the tesseract CLI.")
+
+class PageImage:
+    """
+    A page raster held in memory, ready to be handed to Tesseract: RGB
+    samples, or packed 1-bit rows once `bilevel` (see binarize_text_page).
+    `clip` is set when only part of the page was rendered, together with the
+    full `page_size` in points.
+    """
+
+    def __init__(self, page, width, height, samples, dpi, clip=None, page_size=None, bilevel=False):
+        self.page = page
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.dpi = dpi
+        self.clip = clip
+        self.page_size = page_size
+        self.bilevel = bilevel
+
+    def to_pnm(self):
+        """Binary PPM or PBM: just a header in front of the raw samples, no encoding cost."""
+        if self.bilevel:
+            return b'P4\n%d %d\n' % (self.width, self.height) + self.samples
+        return b'P6\n%d %d\n255\n' % (self.width, self.height) + self.samples
+
+# Lookup tables for bytes.translate over 8-bit grey samples.
+MIDTONE_PIXELS = bytes(1 if 32 <= v < 224 else 0 for v in range(256))
+BLACK_PIXELS = bytes(1 if v < 128 else 0 for v in range(256))
+
+def binarize_text_page(image):
+    """
+    Returns a 1-bit copy of a page render that is nearly pure black and
+    white already (text, line art), which Tesseract's PDF renderer embeds as
+    CCITT G4 rather than JPEG. Anything else is returned unchanged.
+    """
+    if BILEVEL_MAX_MIDTONES <= 0 or image.bilevel:
+        return image
+    with fitz_lock:
+        rgb = fitz.Pixmap(fitz.csRGB, image.width, image.height, image.samples, False)
+        gray = fitz.Pixmap(fitz.csGRAY, rgb).samples
+    if gray.translate(MIDTONE_PIXELS).count(1) > BILEVEL_MAX_MIDTONES * len(gray):
+        return image
+
+    # PBM packs each row 8 pixels to a byte, 1 meaning black, padded to whole bytes.
+    bits = gray.translate(BLACK_PIXELS)
+    width = image.width
+    padding = bytes(-width % 8)
+    rows = bytearray()
+    for y in range(image.height):
+        row = bits[y * width:(y + 1) * width] + padding
+        # Every byte is 0 or 1, so every second hex digit is one pixel.
+        rows += int(row.hex()[1::2], 2).to_bytes(len(row) // 8, 'big')
+    return PageImage(
+        image.page, width, image.height, bytes(rows), image.dpi,
+        clip=image.clip, page_size=image.page_size, bilevel=True
+    )
+
+def run_tesseract_cli(image, output_base, language, renderer='pdf', hocr=False):
+    """
+    OCRs one page image into '<output_base>.<renderer>' by spawning the
+    tesseract binary. With hocr=True '<output_base>.hocr' is written too.
+    """
+    renderers = [renderer, 'hocr'] if hocr else [renderer]
+    # A PPM carries no resolution, so pass it explicitly or the PDF page
+    # size comes out wrong.
+    result = subprocess.run(
+        [
+            'tesseract', 'stdin', output_base, '-l', language, '--dpi', str(image.dpi),
+            '-c', f'jpg_quality={OUTPUT_JPEG_QUALITY}', *renderers
+        ],
+        input=image.to_pnm(), capture_output=True
+    )
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(
+            result.returncode, result.args, stderr=result.stderr.decode(errors='replace')
+        )
+
+def run_tesseract_engine(image, output_base, language):
+    """
+    OCRs one page image into '<output_base>.tsv' with a pooled in-process
+    engine and returns True.
+    """
+    # Word boxes can be read straight from the engine, no file needed.
+    with engine_pool.borrow(language) as api:
+        api.SetVariable('user_defined_dpi', str(image.dpi))
+        api.SetImage(Image.frombytes('RGB', (image.width, image.height), image.samples))
+        tsv = api.GetTSVText(0)
+    with open(output_base + '.tsv', 'w', encoding='utf-8') as f:
+        f.write(tsv)
+    return True
+
+# --- OCR Pipeline Helpers ---
+def open_pdf(pdf_path, filename):
+    """
+    Opens and validates an uploaded PDF. Raises InvalidPdfError for files
+    that are corrupted, password-protected or empty.
+    """
+    with fitz_lock:
+        try:
+            doc = fitz.open(pdf_path, filetype='pdf')
+        except RuntimeError as e:
+            # For any open error, assume it's corrupted or invalid.
+            error_msg = 'The PDF file appears to be corrupted or is not a valid PDF.'
+            print(f"Validation failed for '{filename}': {error_msg}. Details: {e}")
+            raise InvalidPdfError(error_msg)
+        if doc.needs_pass:
+            doc.close()
+            error_msg = 'The PDF file is password-protected and cannot be processed.'
+            print(f"Validation failed for '{filename}': {error_msg}")
+            raise InvalidPdfError(error_msg)
+        if doc.page_count < 1:
+            doc.close()
+            raise InvalidPdfError("The PDF has no pages to process.")
+        return doc
+
+def find_pages_needing_ocr(doc, pages=None):
+    """
+    Returns the 1-based numbers of the pages, out of `pages` or the whole
+    document, that have no usable text layer.
+    """
+    needing_ocr = []
+    with fitz_lock:
+        if pages is None:
+            pages = range(1, doc.page_count + 1)
+        for page_number in pages:
+            if len(''.join(doc[page_number - 1].get_text().split())) < MIN_TEXT_LAYER_CHARS:
+                needing_ocr.append(page_number)
+    return needing_ocr
+
+def contiguous_runs(pages, max_length=None):
+    """
+    Groups sorted page numbers into (first, last) ranges of consecutive
+    pages, splitting any run longer than max_length.
+    """
+    runs = []
+    for page in pages:
+        if runs and page == runs[-1][1] + 1 and (max_length is None or page - runs[-1][0] < max_length):
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [tuple(run) for run in runs]
+
+def render_page_chunk(doc, first_page, last_page, dpi=RENDER_DPI, region=None):
+    """
+    Rasterizes pages first_page..last_page (1-based, inclusive) into memory
+    and returns their PageImages in page order. With a `region` (x0, y0,
+    x1, y1 in points, page as displayed) only that part of each page is
+    rendered.
+    """
+    images = []
+    with fitz_lock:
+        for page_number in range(first_page, last_page + 1):
+            page = doc[page_number - 1]
+            if region is None:
+                pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+                images.append(PageImage(page_number, pix.width, pix.height, pix.samples, dpi))
+                continue
+            clip = fitz.Rect(region) & page.rect
+            if clip.is_empty:
+                raise InvalidPdfError(f"The region lies outside page {page_number}.")
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False, clip=clip)
+            images.append(PageImage(
+                page_number, pix.width, pix.height, pix.samples, dpi,
+                clip=clip, page_size=(page.rect.width, page.rect.height)
+            ))
+    return images
+
+def ocr_page(image, output_base, language, renderer='pdf', hocr=False):
+    """
+    Runs Tesseract on a single page image and returns the path of the
+    '<output_base>.<renderer>' file it produced: a one-page searchable PDF
+    or a TSV of word boxes.
+    """
+    if renderer == 'pdf':
+        image = binarize_text_page(image)
+    done = False
+    if engine_pool is not None and renderer == 'tsv':
+        try:
+            done = run_tesseract_engine(image, output_base, language)
+        except RuntimeError as e:
+            print(f"In-process Tesseract failed for page {image.page}, using the CLI: {e}")
+    if not done:
+        run_tesseract_cli(image, output_base, language, renderer, hocr)
+    output_path = f'{output_base}.{renderer}'
+    if not os.path.exists(output_path):
+        raise FileNotFoundError(f"Tesseract did not create a {renderer.upper()} for page {image.page}.")
+    if image.clip is not None:
+        shift_tsv_to_page(output_path, image)
+    if renderer == 'pdf' and image.dpi > OUTPUT_IMAGE_MAX_DPI and not image.bilevel:
+        downsample_page_pdf(output_path)
+    return output_path
+
+def downsample_page_pdf(pdf_path):
+    """Re-encodes the page image of a Tesseract PDF as a JPEG at OUTPUT_IMAGE_MAX_DPI."""
+    with fitz_lock:
+        with fitz.open(pdf_path) as fragment:
+            # MuPDF subsamples by whole factors and only while the result
+            # stays above the target, hence the target just under the limit.
+            fragment.rewrite_images(
+                dpi_threshold=OUTPUT_IMAGE_MAX_DPI + 10, dpi_target=OUTPUT_IMAGE_MAX_DPI - 1,
+                quality=OUTPUT_JPEG_QUALITY, bitonal=False
+            )
+            fragment.save(pdf_path + '.tmp', garbage=3, deflate=True)
+        os.replace(pdf_path + '.tmp', pdf_path)
+
+def shift_tsv_to_page(tsv_path, image):
+    """
+    Rewrites the TSV of a clipped render so its boxes refer to the whole
+    page, as if the full page had been OCR'd at the same resolution.
+    """
+    scale = image.dpi / 72
+    dx, dy = round(image.clip.x0 * scale), round(image.clip.y0 * scale)
+    page_width, page_height = (round(v * scale) for v in image.page_size)
+    rows = []
+    with open(tsv_path, encoding='utf-8') as f:
+        for row in f:
+            fields = row.rstrip('\n').split('\t')
+            if len(fields) >= 12 and fields[0].isdigit():
+                if fields[0] == '1':
+                    fields[6:10] = ['0', '0', str(page_width), str(page_height)]
+                else:
+                    fields[6] = str(int(fields[6]) + dx)
+                    fields[7] = str(int(fields[7]) + dy)
+            rows.append('\t'.join(fields))
+    with open(tsv_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(rows) + '\n')
+
+def read_page_confidence(output_base, renderer):
+    """
+    Returns the mean word confidence (0-100) Tesseract reported for a page,
+    read from its TSV or from the hOCR written next to its PDF, or None if
+    no words were recognised.
+    """
+    confidences = []
+    if renderer == 'tsv':
+        with open(output_base + '.tsv', encoding='utf-8') as f:
+            for row in f:
+                fields = row.rstrip('\n').split('\t')
+                if len(fields) >= 12 and fields[0] == '5' and fields[11].strip():
+                    confidences.append(float(fields[10]))
+    else:
+        with open(output_base + '.hocr', encoding='utf-8') as f:
+            confidences = [float(conf) for conf in re.findall(r'x_wconf (\d+)', f.read())]
+    confidences = [conf for conf in confidences if conf >= 0]
+    return sum(confidences) / len(confidences) if confidences else None
+
+def ocr_page_adaptive(doc, image, output_base, language, renderer='pdf'):
+    """
+    Like ocr_page for an image rendered at ADAPTIVE_LOW_DPI, but re-renders
+    and re-OCRs the page at ADAPTIVE_HIGH_DPI when the first pass has low
+    confidence. Blank pages are accepted as they are.
+    """
+    output_path = ocr_page(image, output_base, language, renderer, hocr=renderer == 'pdf')
+    confidence = read_page_confidence(output_base, renderer)
+    if confidence is None or confidence >= ADAPTIVE_MIN_CONFIDENCE:
+        return output_path
+    print(
+        f"Page {image.page}: mean confidence {confidence:.0f} at {image.dpi} DPI, "
+        f"retrying at {ADAPTIVE_HIGH_DPI} DPI."
+    )
+    retry_image = render_page_chunk(doc, image.page, image.page, dpi=ADAPTIVE_HIGH_DPI, region=image.clip)[0]
+    return ocr_page(retry_image, output_base, language, renderer)
+
+def iter_ocr_pages(doc, pages, temp_dir, language, renderer='pdf', on_page_done=None, adaptive=False, region=None):
+    """
+    Renders the given pages chunk by chunk and feeds each page to the shared
+    OCR pool while later chunks are being rendered. Yields (page number,
+    OCR output file) pairs in page order as soon as each page is ready (see
+    ocr_page). `on_page_done` is called from the worker thread after each
+    page that succeeds. With `adaptive`, pages start at ADAPTIVE_LOW_DPI
+    (see ocr_page_adaptive); with a `region` only that part of each page is
+    OCR'd (see render_page_chunk).
+    """
+    # Rendered pages hold their images until OCR'd. Up to two chunks' worth
+    # may be in flight; each page gives its slot back as soon as it finishes,
+    # so the pool is topped up page by page instead of draining at the end
+    # of every chunk while its slowest page finishes.
+    in_flight = threading.Semaphore(2 * RENDER_CHUNK_PAGES)
+
+    def page_done(future):
+        in_flight.release()
+        if on_page_done is not None and not future.cancelled() and future.exception() is None:
+            on_page_done()
+
+    futures = OrderedDict()
+    try:
+        for first_page, last_page in contiguous_runs(pages, RENDER_CHUNK_PAGES):
+            chunk_size = last_page - first_page + 1
+            for _ in range(chunk_size):
+                in_flight.acquire()
+            dpi = ADAPTIVE_LOW_DPI if adaptive else RENDER_DPI
+            try:
+                images = render_page_chunk(doc, first_page, last_page, dpi=dpi, region=region)
+            except Exception:
+                for _ in range(chunk_size):
+                    in_flight.release()
+                raise
+
+            while futures and next(iter(futures.values())).done():
+                page, future = futures.popitem(last=False)
+                yield page, future.result()
+
+            for image in images:
+                output_base = os.path.join(temp_dir, f'fragment_{image.page:05d}')
+                if adaptive:
+                    future = ocr_executor.submit(ocr_page_adaptive, doc, image, output_base, language, renderer)
+                else:
+                    future = ocr_executor.submit(ocr_page, image, output_base, language, renderer)
+                future.add_done_callback(page_done)
+                futures[image.page] = future
+            del images
+
+        # A failed page re-raises its CalledProcessError here.
+        while futures:
+            page, future = futures.popitem(last=False)
+            yield page, future.result()
+    finally:
+        # On failure, or when the caller stops early, don't leave workers
+        # writing into a temp dir that is about to vanish.
+        for future in futures.values():
+            future.cancel()
+        wait(futures.values())
+
+def ocr_document_streaming(doc, pages, temp_dir, language, renderer='pdf', on_page_done=None, adaptive=False,
+                           region=None):
+    """Runs iter_ocr_pages to the end and returns a dict of page number to OCR output file."""
+    return dict(iter_ocr_pages(doc, pages, temp_dir, language, renderer, on_page_done, adaptive, region))
+
+def assemble_pdf(doc, fragments, output_path):
+    """
+    Builds the final document: pages with an OCR fragment are taken from the
+    fragment, every other page is copied unchanged from the original.
+    """
+    with fitz_lock:
+        output = fitz.open()
+        original_pages = [page for page in range(1, doc.page_count + 1) if page not in fragments]
+        runs = {first: last for first, last in contiguous_runs(original_pages)}
+        page = 1
+        while page <= doc.page_count:
+            if page in fragments:
+                with fitz.open(fragments[page]) as fragment:
+                    output.insert_pdf(fragment)
+                page += 1
+            else:
+                # Copy whole runs at once so shared resources are copied once.
+                output.insert_pdf(doc, from_page=page - 1, to_page=runs[page] - 1)
+                page = runs[page] + 1
+        # Object streams pack the many small per-page objects together.
+        output.save(output_path, garbage=3, deflate=True, use_objstms=True)
+        output.close()
+    return output_path
+
+def read_tsv_lines(tsv_path):
+    """
+    Parses Tesseract TSV output into the width in pixels of the OCR'd image
+    and its lines of words. Each line is a (left, top, width, height) pixel
+    box plus a list of (left, width, text) words.
+    """
+    image_width = None
+    lines = {}
+    with open(tsv_path, encoding='utf-8') as f:
+        for row in f:
+            fields = row.rstrip('\n').split('\t')
+            if len(fields) < 12 or not fields[0].isdigit():
+                continue  # header or malformed row
+            level = int(fields[0])
+            key = tuple(fields[2:5])  # block, paragraph, line
+            box = tuple(int(v) for v in fields[6:10])
+            if level == 1:
+                image_width = box[2]
+            elif level == 4:
+                lines[key] = (box, [])
+            elif level == 5 and fields[11].strip() and key in lines:
+                lines[key][1].append((box[0], box[2], fields[11]))
+    return image_width, [line for line in lines.values() if line[1]]
+
+def graft_text_layers(doc, tsv_fragments, language, output_path):
+    """
+    Adds an invisible text layer built from each page's TSV word boxes to
+    the original pages and saves the result. Page content is not touched.
+    """
+    cjk_font = GRAFT_CJK_FONTS.get(language)
+    with fitz_lock:
+        if cjk_font:
+            fontname = cjk_font
+            text_length = lambda text, size: fitz.get_text_length(text, fontname=cjk_font, fontsize=size)
+        else:
+            font = fitz.Font('helv')
+            fontname = 'OCRText'
+            text_length = font.text_length
+
+        for page_number, tsv_path in sorted(tsv_fragments.items()):
+            page = doc[page_number - 1]
+            image_width, lines = read_tsv_lines(tsv_path)
+            # Pages may have been OCR'd at different resolutions, so the
+            # pixel-to-point scale comes from each page's own image size.
+            scale = page.rect.width / image_width if image_width else 72 / RENDER_DPI
+            if not cjk_font:
+                # Embedded once per document; later pages reuse the same font.
+                page.insert_font(fontname=fontname, fontbuffer=font.buffer)
+            # Word boxes are in rendered (visual) space; PDF drawing happens in
+            # unrotated page space, so text is placed and scaled accordingly.
+            derotate = page.derotation_matrix
+            rotation = page.rotation
+            shape = page.new_shape()
+            for (line_left, line_top, line_width, line_height), words in lines:
+                fontsize = line_height * scale
+                # Roughly where the baseline sits: descenders take ~20% of a line.
+                baseline = (line_top + line_height * 0.8) * scale
+                for left, width, text in words:
+                    natural_width = text_length(text, fontsize)
+                    if natural_width <= 0:
+                        continue
+                    origin = fitz.Point(left * scale, baseline) * derotate
+                    # Stretch the word horizontally (in visual space) to its box.
+                    stretch = fitz.Matrix(-rotation) * fitz.Matrix(width * scale / natural_width, 1) * fitz.Matrix(rotation)
+                    # The trailing space keeps text extractors from gluing
+                    # neighbouring words together.
+                    shape.insert_text(
+                        origin, text + ' ', fontname=fontname, fontsize=fontsize,
+                        render_mode=3, rotate=rotation, morph=(origin, stretch)
+                    )
+            shape.commit()
+
+        doc.save(output_path, garbage=3, deflate=True, use_objstms=True)
+    return output_path
+
+# --- Sidecar Text Output ---
+TSV_HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+
+def page_record_from_tsv(page_number, page_width, page_height, tsv_path):
+    """
+    Turns a page's Tesseract TSV into a sidecar page record: lines of words
+    with confidences and boxes in PDF points, as the page is displayed.
+    """
+    scale = 72 / RENDER_DPI
+    lines = {}
+    with open(tsv_path, encoding='utf-8') as f:
+        for row in f:
+            fields = row.rstrip('\n').split('\t')
+            if len(fields) < 12 or not fields[0].isdigit():
+                continue  # header or malformed row
+            level = int(fields[0])
+            left, top, width, height = (int(v) for v in fields[6:10])
+            if level == 1 and width:
+                scale = page_width / width
+            bbox = [round(v * scale, 2) for v in (left, top, left + width, top + height)]
+            key = tuple(int(v) for v in fields[2:5])  # block, paragraph, line
+            if level == 4:
+                lines[key] = {'block': key[0], 'paragraph': key[1], 'bbox': bbox, 'words': []}
+            elif level == 5 and fields[11].strip() and key in lines:
+                lines[key]['words'].append({'text': fields[11], 'conf': round(float(fields[10]), 2), 'bbox': bbox})
+    return {
+        'page': page_number, 'source': 'ocr', 'width': page_width, 'height': page_height,
+        'lines': [line for line in lines.values() if line['words']],
+    }
+
+def page_record_from_text_layer(page, region=None):
+    """
+    Builds a sidecar page record from a page's existing text layer, limited
+    to the words inside `region` if one is given.
+    """
+    lines = {}
+    with fitz_lock:
+        # Extraction works in unrotated page space; records use the page as displayed.
+        to_visual = page.rotation_matrix
+        width, height = page.rect.width, page.rect.height
+        clip = fitz.Rect(region) * page.derotation_matrix if region else None
+        words = page.get_text('words', clip=clip, sort=True)
+    for x0, y0, x1, y1, text, block, line, _ in words:
+        rect = fitz.Rect(x0, y0, x1, y1) * to_visual
+        bbox = [round(v, 2) for v in rect]
+        key = (block, line)
+        if key not in lines:
+            lines[key] = {'block': block + 1, 'paragraph': 1, 'bbox': bbox, 'words': []}
+        else:
+            lines[key]['bbox'] = [round(v, 2) for v in fitz.Rect(lines[key]['bbox']) | rect]
+        # Text already in the PDF is exact.
+        lines[key]['words'].append({'text': text, 'conf': 100, 'bbox': bbox})
+    return {'page': page.number + 1, 'source': 'text-layer', 'width': width, 'height': height, 'lines': list(lines.values())}
+
+def record_text(record):
+    """Plain text of a page record: one line per line, blank lines between paragraphs."""
+    text = []
+    previous = None
+    for line in record['lines']:
+        paragraph = (line['block'], line['paragraph'])
+        if previous is not None and paragraph != previous:
+            text.append('')
+        previous = paragraph
+        text.append(' '.join(word['text'] for word in line['words']))
+    return '\n'.join(text)
+
+def to_pixels(bbox):
+    """Converts a box in points to (left, top, width, height) pixels at RENDER_DPI."""
+    x0, y0, x1, y1 = (round(v * RENDER_DPI / 72) for v in bbox)
+    return x0, y0, x1 - x0, y1 - y0
+
+def format_tsv_page(record):
+    """Tesseract-style TSV rows (page, line and word levels) with pixel boxes at RENDER_DPI."""
+    page_number = record['page']
+    _, _, width, height = to_pixels([0, 0, record['width'], record['height']])
+    rows = [f'1\t{page_number}\t0\t0\t0\t0\t0\t0\t{width}\t{height}\t-1\t']
+    for line_number, line in enumerate(record['lines'], 1):
+        ids = f"{page_number}\t{line['block']}\t{line['paragraph']}\t{line_number}"
+        box = '\t'.join(map(str, to_pixels(line['bbox'])))
+        rows.append(f'4\t{ids}\t0\t{box}\t-1\t')
+        for word_number, word in enumerate(line['words'], 1):
+            box = '\t'.join(map(str, to_pixels(word['bbox'])))
+            rows.append(f"5\t{ids}\t{word_number}\t{box}\t{word['conf']}\t{word['text']}")
+    return '\n'.join(rows) + '\n'
+
+def hocr_bbox(bbox):
+    left, top, width, height = to_pixels(bbox)
+    return f'bbox {left} {top} {left + width} {top + height}'
+
+def format_hocr_header(filename):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+        '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">\n'
+        ' <head>\n'
+        f'  <title>{html.escape(filename)}</title>\n'
+        '  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>\n'
+        "  <meta name='ocr-system' content='tesseract'/>\n"
+        "  <meta name='ocr-capabilities' content='ocr_page ocr_line ocrx_word'/>\n"
+        ' </head>\n'
+        ' <body>\n'
+    )
+
+def format_hocr_page(record):
+    """One hOCR ocr_page div, with pixel boxes at RENDER_DPI."""
+    page_number = record['page']
+    parts = [
+        f"  <div class='ocr_page' id='page_{page_number}' title='"
+        f"{hocr_bbox([0, 0, record['width'], record['height']])}; ppageno {page_number - 1}; "
+        f"scan_res {RENDER_DPI} {RENDER_DPI}'>\n"
+    ]
+    for line_number, line in enumerate(record['lines'], 1):
+        line_id = f'{page_number}_{line_number}'
+        parts.append(f"   <span class='ocr_line' id='line_{line_id}' title='{hocr_bbox(line['bbox'])}'>")
+        parts.append(' '.join(
+            f"<span class='ocrx_word' id='word_{line_id}_{word_number}' "
+            f"title='{hocr_bbox(word['bbox'])}; x_wconf {round(word['conf'])}'>{html.escape(word['text'])}</span>"
+            for word_number, word in enumerate(line['words'], 1)
+        ))
+        parts.append('</span>\n')
+    parts.append('  </div>\n')
+    return ''.join(parts)
+
+def iter_page_records(doc, pdf_path, temp_dir, options, filename, progress=None):
+    """
+    Yields a page record (see page_record_from_tsv) for every selected page
+    in order, OCRing the pages that need it and reading the rest from their
+    text layer.
+    """
+    language = options.language
+    with fitz_lock:
+        page_count = doc.page_count
+    ocr_pages = select_ocr_pages(doc, options, filename, progress)
+    file_hash = hash_file(pdf_path)
+    fragments = lookup_cached_pages(file_hash, ocr_pages, temp_dir, options, filename, progress)
+    ocr_results = iter_ocr_pages(
+        doc, [page for page in ocr_pages if page not in fragments], temp_dir, language, options.renderer,
+        on_page_done=progress.page_done if progress else None, adaptive=options.adaptive, region=options.region
+    )
+    ocr_pages = set(ocr_pages)
+    try:
+        for page_number in options.select_pages(page_count):
+            with fitz_lock:
+                page = doc[page_number - 1]
+                width, height = page.rect.width, page.rect.height
+            if page_number not in ocr_pages:
+                yield page_record_from_text_layer(page, options.region)
+                continue
+            if page_number in fragments:
+                tsv_path = fragments[page_number]
+            else:
+                # OCR results arrive in page order, so this is always this page.
+                _, tsv_path = next(ocr_results)
+                page_cache.put(file_hash, language, page_number, options.cache_kind, tsv_path)
+            yield page_record_from_tsv(page_number, width, height, tsv_path)
+    finally:
+        ocr_results.close()
+
+def stream_sidecar(doc, pdf_path, temp_dir, options, filename, progress=None):
+    """Yields the document's text in options.output_format, one page at a time."""
+    output_format = options.output_format
+    if output_format == 'tsv':
+        yield TSV_HEADER
+    elif output_format == 'hocr':
+        yield format_hocr_header(filename)
+    elif output_format == 'json':
+        yield '{"filename": %s, "language": %s, "pages": [\n' % (json.dumps(filename), json.dumps(options.language))
+
+    for index, record in enumerate(iter_page_records(doc, pdf_path, temp_dir, options, filename, progress)):
+        if output_format == 'txt':
+            # Like Tesseract's own text output, every page ends with a form feed.
+            yield record_text(record) + '\n\f'
+        elif output_format == 'tsv':
+            yield format_tsv_page(record)
+        elif output_format == 'hocr':
+            yield format_hocr_page(record)
+        else:
+            yield (',\n' if index else '') + json.dumps({**record, 'text': record_text(record)}, ensure_ascii=False)
+
+    if output_format == 'hocr':
+        yield ' </body>\n</html>\n'
+    elif output_format == 'json':
+        yield '\n]}\n'
+
+# --- OCR Processing ---
+class InvalidPdfError(Exception):
+    """Raised when an upload cannot be processed; the message is shown to the user."""
+
+def parse_page_ranges(spec):
+    """
+    Parses a page selection such as '1-3,7,10-' into (first, last) pairs,
+    with last None for an open-ended range. Raises InvalidPdfError.
+    """
+    ranges = []
+    for part in spec.replace(' ', '').split(','):
+        match = re.fullmatch(r'(\d+)(-(\d*))?', part)
+        first = int(match.group(1)) if match else 0
+        if match is None or match.group(2) is None:
+            last = first
+        else:
+            last = int(match.group(3)) if match.group(3) else None
+        if first < 1 or (last is not None and last < first):
+            raise InvalidPdfError(f"Invalid page range '{part}'. Use a list such as 1-3,7,10-.")
+        ranges.append((first, last))
+    return ranges
+
+def parse_region(spec):
+    """Parses 'x0,y0,x1,y1' (points from the top-left of the page as displayed). Raises InvalidPdfError."""
+    try:
+        region = tuple(float(v) for v in spec.split(','))
+    except ValueError:
+        region = ()
+    if len(region) != 4 or region[2] <= region[0] or region[3] <= region[1]:
+        raise InvalidPdfError(
+            'Invalid region. Give it as x0,y0,x1,y1 in points from the top-left corner of the page.'
+        )
+    return region
+
+class OcrOptions:
+    """Per-request OCR settings, shared by /ocr and /jobs."""
+
+    def __init__(self, language='eng', force_ocr=False, output_mode=DEFAULT_OUTPUT_MODE, adaptive=ADAPTIVE_OCR,
+                 output_format='pdf', pages=None, region=None):
+        self.language = language
+        self.force_ocr = force_ocr
+        self.output_mode = output_mode
+        self.adaptive = adaptive
+        self.output_format = output_format
+        self.pages = pages    # (first, last) ranges from parse_page_ranges, None for all
+        self.region = region  # (x0, y0, x1, y1) in points, None for the whole page
+
+    @property
+    def renderer(self):
+        if self.output_format in SIDECAR_FORMATS:
+            return 'tsv'  # every sidecar format is built from the word boxes
+        return MODE_RENDERERS[self.output_mode]
+
+    @property
+    def mimetype(self):
+        if self.output_format in SIDECAR_FORMATS:
+            return SIDECAR_FORMATS[self.output_format][0]
+        return 'application/pdf'
+
+    def output_filename(self, filename):
+        base = os.path.splitext(filename)[0]
+        if self.output_format in SIDECAR_FORMATS:
+            return base + SIDECAR_FORMATS[self.output_format][1]
+        return base + '_searchable.pdf'
+
+    @property
+    def cache_kind(self):
+        # Adaptive pages may be low resolution and regions cover only part
+        # of a page, so both are cached apart from full-page results.
+        parts = [self.renderer]
+        if self.region:
+            parts.insert(0, 'region_' + '_'.join(f'{v:g}' for v in self.region))
+        if self.adaptive:
+            parts.insert(0, 'adaptive')
+        return '.'.join(parts)
+
+    def select_pages(self, page_count):
+        """The 1-based page numbers picked by `pages`, in order. Raises InvalidPdfError."""
+        if not self.pages:
+            return list(range(1, page_count + 1))
+        selected = set()
+        for first, last in self.pages:
+            if first > page_count:
+                raise InvalidPdfError(f"Page {first} is out of range; the document has {page_count} pages.")
+            selected.update(range(first, min(last or page_count, page_count) + 1))
+        return sorted(selected)
+
+    @classmethod
+    def from_form(cls, form):
+        """Reads and validates the options from an upload form. Raises InvalidPdfError."""
+        language = form.get('language', 'eng')
+        if language not in SUPPORTED_LANGUAGES:
+            error_msg = f"Unsupported language '{language}'."
+            print(f"Error: {error_msg}")
+            raise InvalidPdfError(error_msg)
+        output_mode = form.get('output_mode', DEFAULT_OUTPUT_MODE)
+        if output_mode not in OUTPUT_MODES:
+            raise InvalidPdfError(f"Unsupported output mode '{output_mode}'. Use one of: {', '.join(OUTPUT_MODES)}.")
+        output_format = form.get('output_format', 'pdf')
+        if output_format not in OUTPUT_FORMATS:
+            raise InvalidPdfError(f"Unsupported output format '{output_format}'. Use one of: {', '.join(OUTPUT_FORMATS)}.")
+        pages = parse_page_ranges(form['pages']) if form.get('pages', '').strip() else None
+        region = parse_region(form['region']) if form.get('region', '').strip() else None
+        if region and output_format == 'pdf' and output_mode == 'image':
+            # Image mode swaps the whole page for its scan, which a partial OCR can't provide.
+            raise InvalidPdfError('A region needs output_mode=graft or a text output format.')
+        return cls(
+            language=language,
+            force_ocr=form.get('force_ocr', 'false').lower() == 'true',
+            output_mode=output_mode,
+            adaptive=form.get('adaptive', str(ADAPTIVE_OCR)).lower() == 'true',
+            output_format=output_format,
+            pages=pages,
+            region=region,
+        )
+
+def parse_ocr_request():
+    """
+    Checks the upload form shared by /ocr and /jobs and returns the file and
+    its OcrOptions. Raises InvalidPdfError with a user-facing message.
+    """
+    if 'file' not in request.files:
+        raise InvalidPdfError('No file part in request.')
+    file = request.files['file']
+    if file.filename == '':
+        raise InvalidPdfError('No file selected.')
+    options = OcrOptions.from_form(request.form)
+    if not file.filename.lower().endswith('.pdf'):
+        raise InvalidPdfError('Invalid file type. Please upload a PDF.')
+    return file, options
+
+def process_pdf(pdf_path, temp_dir, options, filename, progress=None):
+    """
+    Runs the whole OCR pipeline on an uploaded PDF saved in temp_dir and
+    returns the path of the searchable PDF, or of the sidecar text file for
+    sidecar output formats. `progress`, if given, is told about stage
+    changes and every page that finishes.
+    """
+    # --- STEP 1: Validate the PDF before processing ---
+    doc = open_pdf(pdf_path, filename)
+    try:
+        if options.output_format in SIDECAR_FORMATS:
+            output_path = os.path.join(temp_dir, 'output' + SIDECAR_FORMATS[options.output_format][1])
+            with open(output_path, 'w', encoding='utf-8') as f:
+                for chunk in stream_sidecar(doc, pdf_path, temp_dir, options, filename, progress):
+                    f.write(chunk)
+            return output_path
+        return process_document(doc, pdf_path, temp_dir, options, filename, progress)
+    finally:
+        with fitz_lock:
+            doc.close()
+
+def select_ocr_pages(doc, options, filename, progress):
+    """Step 2: the selected pages to OCR, which are all of them with force_ocr."""
+    with fitz_lock:
+        page_count = doc.page_count
+    selected = options.select_pages(page_count)
+    if options.force_ocr:
+        ocr_pages = selected
+    else:
+        ocr_pages = find_pages_needing_ocr(doc, selected)
+    print(f"'{filename}': {len(ocr_pages)} of {len(selected)} pages need OCR.")
+    if progress:
+        progress.set_stage('ocr', pages_total=len(ocr_pages))
+    return ocr_pages
+
+def lookup_cached_pages(file_hash, pages, temp_dir, options, filename, progress):
+    """Step 3: copies cached OCR output for the given pages into temp_dir. Returns {page: path}."""
+    fragments = {}
+    for page in pages:
+        cached_path = os.path.join(temp_dir, f'cached_{page:05d}.{options.renderer}')
+        if page_cache.get(file_hash, options.language, page, options.cache_kind, cached_path):
+            fragments[page] = cached_path
+            if progress:
+                progress.page_done()
+    if fragments:
+        print(f"'{filename}': {len(fragments)} pages served from the OCR cache.")
+    return fragments
+
+def process_document(doc, pdf_path, temp_dir, options, filename, progress):
+    """Steps 2-5 of process_pdf, run against the already opened document."""
+    language = options.language
+    renderer = options.renderer
+    cache_kind = options.cache_kind
+
+    # --- STEP 2: Find the pages that have no text layer yet ---
+    ocr_pages = select_ocr_pages(doc, options, filename, progress)
+    if not ocr_pages:
+        # Every page is already searchable; hand the original back.
+        return pdf_path
+
+    # --- STEP 3: Reuse pages OCR'd for an identical earlier upload ---
+    file_hash = hash_file(pdf_path)
+    fragments = lookup_cached_pages(file_hash, ocr_pages, temp_dir, options, filename, progress)
+    pages_to_ocr = [page for page in ocr_pages if page not in fragments]
+
+    # --- STEP 4: Rasterize in chunks and OCR pages as they arrive ---
+    ocr_fragments = ocr_document_streaming(
+        doc, pages_to_ocr, temp_dir, language, renderer,
+        on_page_done=progress.page_done if progress else None, adaptive=options.adaptive, region=options.region
+    )
+    for page, fragment_path in ocr_fragments.items():
+        page_cache.put(file_hash, language, page, cache_kind, fragment_path)
+    fragments.update(ocr_fragments)
+
+    # --- STEP 5: Build the output, keeping searchable pages as they are ---
+    if progress:
+        progress.set_stage('merging')
+    output_pdf_path = os.path.join(temp_dir, 'output.pdf')
+    if options.output_mode == 'graft':
+        graft_text_layers(doc, fragments, language, output_pdf_path)
+    else:
+        assemble_pdf(doc, fragments, output_pdf_path)
+
+    if not os.path.exists(output_pdf_path):
+        raise FileNotFoundError("The merged output PDF file was not created.")
+    return output_pdf_path
+
+def describe_failure(filename, e):
+    """Turns an exception from process_pdf into a user-facing message and HTTP status."""
+    if isinstance(e, InvalidPdfError):
+        return str(e), 400
+    if isinstance(e, subprocess.CalledProcessError):
+        error_details = e.stderr or "No error details available."
+        print(f"Subprocess failed for '{filename}'. Stderr: {error_details}")
+        # Provide a more user-friendly message for common syntax errors.
+        if "syntax" in error_details.lower():
+            return 'Processing failed. The PDF may be corrupted.', 500
+        return f"Processing failed. Details: {error_details}", 500
+    print(f"An unexpected error occurred for '{filename}': {e}")
+    return f'An unexpected server error occurred: {str(e)}', 500
+
+# --- Background OCR Jobs ---
+class OcrJob:
+    """
+    State of one asynchronous OCR job. Every change bumps `version` and wakes
+    up anyone waiting on `updated`, which is how the SSE stream follows it.
+    """
+
+    def __init__(self, filename, options):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.options = options
+        self.directory = os.path.join(JOB_FOLDER, self.id)
+        self.status = 'queued'
+        self.pages_done = 0
+        self.pages_total = None
+        self.error = None
+        self.error_status = None
+        self.output_path = None
+        self.finished_at = None
+        self.version = 0
+        self.updated = threading.Condition()
+
+    @property
+    def output_filename(self):
+        return self.options.output_filename(self.filename)
+
+    def _changed(self):
+        self.version += 1
+        self.updated.notify_all()
+
+    def set_stage(self, status, pages_total=None):
+        with self.updated:
+            self.status = status
+            if pages_total is not None:
+                self.pages_total = pages_total
+            self._changed()
+
+    def page_done(self):
+        # Called from OCR worker threads.
+        with self.updated:
+            self.pages_done += 1
+            self._changed()
+
+    def finish(self, output_path=None, error=None, error_status=None):
+        with self.updated:
+            self.status = 'failed' if error else 'done'
+            self.output_path = output_path
+            self.error = error
+            self.error_status = error_status
+            self.finished_at = time.time()
+            self._changed()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'pages_done': self.pages_done,
+            'pages_total': self.pages_total,
+            'error': self.error,
+        }
+
+jobs = {}
+jobs_lock = threading.Lock()
+
+def run_job(job):
+    """Worker-pool entry point for a submitted job."""
+    job.set_stage('validating')
+    pdf_path = os.path.join(job.directory, job.filename)
+    try:
+        output_pdf_path = process_pdf(pdf_path, job.directory, job.options, job.filename, progress=job)
+    except Exception as e:
+        error_msg, status = describe_failure(job.filename, e)
+        job.finish(error=error_msg, error_status=status)
+        return
+    print(f"Job {job.id}: created {job.options.output_format} output for '{job.filename}'.")
+    job.finish(output_path=output_pdf_path)
+
+def purge_expired_jobs():
+    """Forgets finished jobs older than JOB_RESULT_TTL and deletes their files."""
+    cutoff = time.time() - JOB_RESULT_TTL
+    with jobs_lock:
+        expired = [job for job in jobs.values() if job.finished_at and job.finished_at < cutoff]
+        for job in expired:
+            del jobs[job.id]
+    for job in expired:
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+def get_job_or_404(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': 'Job not found or has expired.'}), 404)
+    return job, None
+
 # --- API Endpoints ---
 @app.route('/')
 def index():
@@ -60,100 +1318,174 @@ def get_languages():
     print("Request received for /languages endpoint.")
     return jsonify(SUPPORTED_LANGUAGES)
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    # Counters are per server process.
+    return jsonify(page_cache.stats())
+
 @app.route('/ocr', methods=['POST'])
 def ocr_pdf():
     print("Request received for /ocr endpoint.")
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part in request.'}), 400
-    
-    file = request.files['file']
-    language = request.form.get('language', 'eng')
-    
-    if file.filename == '':
-        return jsonify({'error': 'No file selected.'}), 400
-        
-    if language not in SUPPORTED_LANGUAGES:
-        error_msg = f"Unsupported language '{language}'."
-        print(f"Error: {error_msg}")
-        return jsonify({'error': error_msg}), 400
-
-    if file and file.filename.lower().endswith('.pdf'):
-        filename = secure_filename(file.filename)
-        output_filename = os.path.splitext(filename)[0] + '_searchable.pdf'
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            pdf_path = os.path.join(temp_dir, filename)
-            file.save(pdf_path)
-            
-            try:
-                # --- STEP 1: Validate the PDF before processing ---
-                # Use pdfinfo to check for corruption or password protection.
-                pdfinfo_proc = subprocess.run(
-                    ['pdfinfo', pdf_path],
-                    capture_output=True, text=True
-                )
-                
-                # Check for errors from pdfinfo. A non-zero return code means failure.
-                if pdfinfo_proc.returncode != 0:
-                    stderr_lower = pdfinfo_proc.stderr.lower()
-                    if 'password' in stderr_lower:
-                        error_msg = 'The PDF file is password-protected and cannot be processed.'
-                        print(f"Validation failed for '{filename}': {error_msg}")
-                        return jsonify({'error': error_msg}), 400
-                    else:
-                        # For any other error, assume it's corrupted or invalid.
-                        error_msg = 'The PDF file appears to be corrupted or is not a valid PDF.'
-                        print(f"Validation failed for '{filename}': {error_msg}. Details: {pdfinfo_proc.stderr}")
-                        return jsonify({'error': error_msg}), 400
-
-                # --- STEP 2: Convert valid PDF to images ---
-                image_prefix = os.path.join(temp_dir, 'page_img')
-                subprocess.run(
-                    ['pdftoppm', '-tiff', pdf_path, image_prefix],
-                    check=True, capture_output=True, text=True
-                )
-                
-                image_files = sorted([f for f in os.listdir(temp_dir) if f.startswith('page_img')])
-                if not image_files:
-                    raise ValueError("PDF could not be converted into images. It might be empty or corrupt.")
-
-                image_list_path = os.path.join(temp_dir, 'image_list.txt')
-                with open(image_list_path, 'w') as f:
-                    for img in image_files:
-                        f.write(os.path.join(temp_dir, img) + '\n')
-
-                # --- STEP 3: Run OCR on the images to create a new PDF ---
-                output_pdf_base = os.path.join(temp_dir, 'output')
-                subprocess.run(
-                    ['tesseract', image_list_path, output_pdf_base, '-l', language, 'pdf'],
-                    check=True, capture_output=True, text=True
-                )
-                
-                output_pdf_path = output_pdf_base + '.pdf'
-                if not os.path.exists(output_pdf_path):
-                    raise FileNotFoundError("Tesseract did not create the output PDF file.")
-
-                print(f"Successfully created searchable PDF for '{filename}'.")
-                
-                return send_file(
-                    output_pdf_path,
-                    mimetype='application/pdf',
-                    as_attachment=True,
-                    download_name=output_filename
-                )
-
-            except subprocess.CalledProcessError as e:
-                error_details = e.stderr or "No error details available."
-                print(f"Subprocess failed for '{filename}'. Stderr: {error_details}")
-                # Provide a more user-friendly message for common syntax errors.
-                if "syntax" in error_details.lower():
-                     return jsonify({'error': 'Processing failed. The PDF may be corrupted.'}), 500
-                return jsonify({'error': f"Processing failed. Details: {error_details}"}), 500
-            except Exception as e:
-                print(f"An unexpected error occurred for '{filename}': {e}")
-                return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
-    else:
-        return jsonify({'error': 'Invalid file type. Please upload a PDF.'}), 400
+    # Synchronous requests tie up a server thread, so keep them small; larger
+    # documents go through /jobs.
+    if request.content_length and request.content_length > SYNC_MAX_CONTENT_LENGTH:
+        limit_mb = SYNC_MAX_CONTENT_LENGTH // (1024 * 1024)
+        return jsonify({'error': f'Files over {limit_mb} MB must be submitted to /jobs.'}), 413
+
+    try:
+        file, options = parse_ocr_request()
+    except InvalidPdfError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = secure_filename(file.filename)
+    output_filename = options.output_filename(filename)
+    if options.output_format in SIDECAR_FORMATS:
+        return stream_sidecar_response(file, filename, options)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = os.path.join(temp_dir, filename)
+        file.save(pdf_path)
+
+        try:
+            output_pdf_path = process_pdf(pdf_path, temp_dir, options, filename)
+        except Exception as e:
+            error_msg, status = describe_failure(filename, e)
+            return jsonify({'error': error_msg}), status
+
+        print(f"Successfully created searchable PDF for '{filename}'.")
+
+        return send_file(
+            output_pdf_path,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=output_filename
+        )
+
+def stream_sidecar_response(file, filename, options):
+    """
+    Answers /ocr with the document's text in a sidecar format, streamed as
+    each page is ready instead of after the whole document.
+    """
+    temp_dir = tempfile.mkdtemp()
+    pdf_path = os.path.join(temp_dir, filename)
+    file.save(pdf_path)
+    try:
+        doc = open_pdf(pdf_path, filename)
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        error_msg, status = describe_failure(filename, e)
+        return jsonify({'error': error_msg}), status
+
+    def cleanup():
+        with fitz_lock:
+            doc.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Catch out-of-range pages now; once streaming starts the status is sent.
+    try:
+        with fitz_lock:
+            options.select_pages(doc.page_count)
+    except InvalidPdfError as e:
+        cleanup()
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        try:
+            yield from stream_sidecar(doc, pdf_path, temp_dir, options, filename)
+        except Exception as e:
+            # The 200 status is already sent; cutting the stream short is
+            # how the client learns that it failed.
+            describe_failure(filename, e)
+            raise
+        print(f"Successfully streamed {options.output_format} output for '{filename}'.")
+
+    response = Response(generate(), mimetype=options.mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{options.output_filename(filename)}"',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(cleanup)
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queues an OCR job and returns its ID immediately (202 Accepted)."""
+    print("Request received for /jobs endpoint.")
+    try:
+        file, options = parse_ocr_request()
+    except InvalidPdfError as e:
+        return jsonify({'error': str(e)}), 400
+
+    purge_expired_jobs()
+
+    job = OcrJob(secure_filename(file.filename), options)
+    os.makedirs(job.directory)
+    file.save(os.path.join(job.directory, job.filename))
+
+    with jobs_lock:
+        jobs[job.id] = job
+    job_executor.submit(run_job, job)
+    print(f"Job {job.id} queued for '{job.filename}'.")
+
+    return jsonify({
+        **job.to_dict(),
+        'status_url': f'/jobs/{job.id}',
+        'events_url': f'/jobs/{job.id}/events',
+        'result_url': f'/jobs/{job.id}/result',
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job, error_response = get_job_or_404(job_id)
+    if error_response:
+        return error_response
+    with job.updated:
+        return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events stream of job progress; ends once the job finishes."""
+    job, error_response = get_job_or_404(job_id)
+    if error_response:
+        return error_response
+
+    def stream():
+        seen_version = -1
+        while True:
+            with job.updated:
+                job.updated.wait_for(lambda: job.version != seen_version, timeout=SSE_KEEPALIVE_SECONDS)
+                if job.version == seen_version:
+                    payload = None
+                else:
+                    seen_version = job.version
+                    payload = job.to_dict()
+            if payload is None:
+                # Comment line; keeps proxies from closing an idle stream.
+                yield ': keep-alive\n\n'
+                continue
+            yield f"data: {json.dumps(payload)}\n\n"
+            if payload['status'] in ('done', 'failed'):
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job, error_response = get_job_or_404(job_id)
+    if error_response:
+        return error_response
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), job.error_status
+    if job.status != 'done':
+        return jsonify({'error': 'The job has not finished yet.', **job.to_dict()}), 409
+    return send_file(
+        job.output_path,
+        mimetype=job.options.mimetype,
+        as_attachment=True,
+        download_name=job.output_filename
+    )
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
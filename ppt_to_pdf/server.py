@@ -1,13 +1,32 @@
 import os
+import atexit
+import fcntl
+import json
+import math
+import pathlib
+import queue
+import signal
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 import uuid
 import zipfile
+import zlib
 import shutil
-from flask import Flask, request, send_from_directory, jsonify, make_response, render_template
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from flask import Flask, Response, request, send_from_directory, jsonify, make_response, render_template
 
 # Initialize Flask App and tell it where to find template files
 app = Flask(__name__, static_folder='static', template_folder='static')
 
+# `python server.py` runs with the reloader: this module is imported again in
+# a child process that does the serving, while the parent only watches files.
+# Offices and the janitor are started in the serving process only.
+SERVING = __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -15,6 +34,45 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 128 * 1024 * 1024 # 128MB limit
 ALLOWED_EXTENSIONS = {'ppt', 'pptx'}
 
+# LibreOffice workers: long-lived headless instances, each with its own
+# profile. OFFICE_WORKERS=0 goes back to one office launch per file.
+# Profiles are per server process and ports are picked free by default, so
+# several gunicorn workers never share an office.
+OFFICE_WORKERS = int(os.environ.get('OFFICE_WORKERS', 2))
+OFFICE_PROFILE_DIR = os.environ.get('OFFICE_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'ppt_to_pdf_profiles'))
+OFFICE_BASE_PORT = int(os.environ.get('OFFICE_BASE_PORT', 0))  # 0: any free port; else worker N listens on BASE + N
+OFFICE_START_TIMEOUT = int(os.environ.get('OFFICE_START_TIMEOUT', 60))  # seconds
+OFFICE_HEALTH_INTERVAL = int(os.environ.get('OFFICE_HEALTH_INTERVAL', 30))  # seconds
+OFFICE_MAX_CONVERSIONS = int(os.environ.get('OFFICE_MAX_CONVERSIONS', 200))  # then restart, to shed leaks
+CONVERSION_TIMEOUT = int(os.environ.get('CONVERSION_TIMEOUT', 120))  # seconds
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 100))
+
+# Admission control: at most CONVERSION_SLOTS conversions run at once and up
+# to MAX_QUEUED_CONVERSIONS more wait for a slot; beyond that requests are
+# turned away with 503 straight away instead of piling up.
+CONVERSION_SLOTS = int(os.environ.get('CONVERSION_SLOTS', max(OFFICE_WORKERS, 1)))
+MAX_QUEUED_CONVERSIONS = int(os.environ.get('MAX_QUEUED_CONVERSIONS', 64))
+QUEUE_TIMEOUT = int(os.environ.get('QUEUE_TIMEOUT', 300))  # seconds a batch deck may wait for a slot
+# A conversion request holds one of gunicorn's request threads until it is
+# answered: a single deck for its whole conversion, a batch while it streams.
+# REQUEST_THREADS must match --threads; conversion requests may hold all but
+# two of them, so downloads, ZIPs and stats are always served.
+REQUEST_THREADS = int(os.environ.get('REQUEST_THREADS', 8))
+MAX_CONVERSION_REQUESTS = int(os.environ.get('MAX_CONVERSION_REQUESTS', max(REQUEST_THREADS - 2, 1)))
+SINGLE_QUEUE_TIMEOUT = int(os.environ.get('SINGLE_QUEUE_TIMEOUT', 60))  # seconds, then 503
+
+# Janitor: job dirs are normally removed when downloaded. Abandoned ones are
+# removed after JOB_TTL, or oldest first while uploads/ is over its budget.
+# Jobs still waiting for or going through conversion are never touched: they
+# hold a lock on a file in their dir, which the janitor of every server
+# process can see.
+JOB_TTL = int(os.environ.get('JOB_TTL', 60 * 60))  # seconds
+UPLOADS_MAX_BYTES = int(os.environ.get('UPLOADS_MAX_MB', 2048)) * 1024 * 1024
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 60))  # seconds
+JOB_MIN_AGE = int(os.environ.get('JOB_MIN_AGE', 5 * 60))  # seconds a converted job is kept for its download
+ZIP_CHUNK_BYTES = 256 * 1024  # read size when streaming files into a ZIP
+ZIP_DEFLATE_MIN_SAVING = 0.1  # deflate an entry only if a sample shrinks by this much
+
 def allowed_file(filename):
     """Checks if the uploaded file has an allowed extension."""
     return '.' in filename and \
@@ -28,6 +86,478 @@ def cleanup(directory):
     except Exception as e:
         print(f"Error during cleanup of {directory}: {e}")
 
+def free_port():
+    """A local port nothing is listening on right now."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def office_command(profile_dir):
+    """Base LibreOffice command line using the given profile directory."""
+    return [
+        'libreoffice', f'-env:UserInstallation={pathlib.Path(profile_dir).absolute().as_uri()}',
+        '--headless', '--invisible', '--nologo', '--norestore', '--nolockcheck'
+    ]
+
+class OfficeWorker:
+    """
+    One headless LibreOffice instance with its own profile, listening on a
+    local socket. A conversion is a `--convert-to` run against the same
+    profile: LibreOffice hands it to the running instance over its IPC pipe
+    instead of booting a new office, so it costs a fraction of a cold start.
+    """
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.profile_dir = os.path.join(OFFICE_PROFILE_DIR, f'worker-{os.getpid()}-{slot}')
+        self.port = None
+        self.process = None
+        self.conversions = 0
+
+    def start(self):
+        self.port = OFFICE_BASE_PORT + self.slot if OFFICE_BASE_PORT else free_port()
+        self.process = subprocess.Popen(
+            office_command(self.profile_dir) + [f'--accept=socket,host=127.0.0.1,port={self.port};urp;'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True  # the launcher forks soffice.bin; stop() kills the whole group
+        )
+        self.conversions = 0
+        deadline = time.monotonic() + OFFICE_START_TIMEOUT
+        while not self.is_healthy():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError(f"LibreOffice worker {self.slot} did not start.")
+            time.sleep(0.2)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        try:
+            self.start()
+        except RuntimeError:
+            # A crash can leave the profile unusable; start over with a fresh one.
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.start()
+        print(f"Restarted LibreOffice worker {self.slot}.")
+
+    def is_healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    def convert(self, input_path, output_dir):
+        try:
+            subprocess.run(
+                office_command(self.profile_dir) + ['--convert-to', 'pdf', '--outdir', output_dir, input_path],
+                check=True, timeout=CONVERSION_TIMEOUT,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except subprocess.TimeoutExpired:
+            # The instance is probably stuck on this document.
+            self.restart()
+            raise
+        except subprocess.CalledProcessError:
+            if not self.is_healthy():
+                self.restart()
+            raise
+        self.conversions += 1
+
+class OfficePool:
+    """
+    A fixed set of OfficeWorkers. Each handles one conversion at a time, so at
+    most OFFICE_WORKERS documents are converted at once and the rest wait
+    their turn. Workers are checked before use and by a background watchdog,
+    and restarted when they have died.
+    """
+
+    def __init__(self, size):
+        self.workers = [OfficeWorker(slot) for slot in range(size)]
+        self._idle = queue.Queue()
+
+    def start(self):
+        for worker in self.workers:
+            try:
+                worker.start()
+                print(f"Started LibreOffice worker {worker.slot} on port {worker.port}.")
+            except RuntimeError as e:
+                print(f"Warning: {e} It will be retried on first use.")
+            self._idle.put(worker)
+        threading.Thread(target=self._watchdog, name='office-watchdog', daemon=True).start()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+            shutil.rmtree(worker.profile_dir, ignore_errors=True)
+
+    @contextmanager
+    def borrow(self):
+        worker = self._idle.get()
+        try:
+            if not worker.is_healthy() or worker.conversions >= OFFICE_MAX_CONVERSIONS:
+                worker.restart()
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+    def _watchdog(self):
+        while True:
+            time.sleep(OFFICE_HEALTH_INTERVAL)
+            # Only idle workers are checked; busy ones are checked when returned.
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not worker.is_healthy():
+                        worker.restart()
+                except RuntimeError as e:
+                    print(f"Warning: {e}")
+                finally:
+                    self._idle.put(worker)
+
+office_pool = OfficePool(OFFICE_WORKERS) if OFFICE_WORKERS > 0 else None
+
+if office_pool is not None and SERVING:
+    # Workers boot in the background; conversions wait in borrow() until one is up.
+    threading.Thread(target=office_pool.start, name='office-start', daemon=True).start()
+    atexit.register(office_pool.stop)
+
+def convert_to_pdf(input_path, output_dir):
+    """Converts a deck to PDF in output_dir, on a pooled worker when there are any."""
+    if office_pool is not None:
+        with office_pool.borrow() as worker:
+            worker.convert(input_path, output_dir)
+        return
+    # A private profile per run, so concurrent launches don't fight over one.
+    profile_dir = tempfile.mkdtemp(prefix='ppt_to_pdf_profile_')
+    try:
+        subprocess.run(
+            office_command(profile_dir) + ['--convert-to', 'pdf', '--outdir', output_dir, input_path],
+            check=True, timeout=CONVERSION_TIMEOUT
+        )
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"The conversion queue is full; retry in {retry_after} s.")
+        self.retry_after = retry_after
+
+class ConversionScheduler:
+    """
+    Bounds conversions. Requests are admitted up front, all or nothing, while
+    running plus waiting conversions fit in CONVERSION_SLOTS +
+    MAX_QUEUED_CONVERSIONS and fewer than MAX_CONVERSION_REQUESTS requests
+    are holding a request thread; an admitted conversion then waits a
+    bounded time for one of CONVERSION_SLOTS to run in.
+    """
+
+    def __init__(self, slots, max_queued, max_requests):
+        self.slots = slots
+        self.max_queued = max_queued
+        self.max_requests = max_requests
+        self._slots = threading.Semaphore(slots)
+        self._lock = threading.Lock()
+        self.admitted = 0  # running + waiting
+        self.requests = 0  # request threads held by admitted requests
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.average_seconds = 10.0  # moving average, seeds Retry-After before any data
+
+    def admit(self, count=1):
+        """Admits a request for `count` conversions. Call finish() once it has been answered."""
+        with self._lock:
+            if self.requests >= self.max_requests or self.admitted + count > self.slots + self.max_queued:
+                self.rejected += count
+                raise QueueFull(self._retry_after())
+            self.admitted += count
+            self.requests += 1
+
+    def release(self, count=1):
+        """Gives back admissions that will never run."""
+        with self._lock:
+            self.admitted -= count
+
+    def finish(self):
+        """Gives back the request thread of an admitted request."""
+        with self._lock:
+            self.requests -= 1
+
+    def run(self, convert, *args, timeout=QUEUE_TIMEOUT):
+        """Runs an admitted conversion once a slot is free; QueueFull if none frees up within timeout."""
+        try:
+            if not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self.timed_out += 1
+                    raise QueueFull(self._retry_after())
+            started = time.monotonic()
+            with self._lock:
+                self.running += 1
+            try:
+                result = convert(*args)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.average_seconds += (time.monotonic() - started - self.average_seconds) * 0.2
+                self._slots.release()
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            self.release()
+
+    def _retry_after(self):
+        # Roughly when a slot for one more conversion should open up.
+        waiting = max(self.admitted - self.slots, 0)
+        return max(1, math.ceil(self.average_seconds * (waiting + 1) / self.slots))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'running': self.running,
+                'queued': self.admitted - self.running,
+                'max_queued': self.max_queued,
+                'requests': self.requests,
+                'max_requests': self.max_requests,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'average_seconds': round(self.average_seconds, 2),
+            }
+
+scheduler = ConversionScheduler(CONVERSION_SLOTS, MAX_QUEUED_CONVERSIONS, MAX_CONVERSION_REQUESTS)
+
+def queue_full_response(e):
+    return conversion_response({"error": str(e), "retry_after": e.retry_after}, 503)
+
+def conversion_response(result, status):
+    response = jsonify(result)
+    response.status_code = status
+    if 'retry_after' in result:
+        response.headers['Retry-After'] = str(result['retry_after'])
+    return response
+
+# Batch conversions wait for their slot here rather than in request threads.
+batch_executor = ThreadPoolExecutor(max_workers=CONVERSION_SLOTS, thread_name_prefix='convert')
+
+# From save_upload() to the end of convert_job() a job holds an flock on
+# this file in its dir, so the janitor leaves it alone however long it has
+# been queued. The lock goes away with the process that held it, so a job
+# orphaned by a crash is collected as usual.
+JOB_LOCK_FILE = '.converting'
+job_locks = {}  # job_dir -> open lock file, for this process's jobs
+job_locks_lock = threading.Lock()
+
+def save_upload(file):
+    """
+    Saves an uploaded deck into a new job directory. Returns (job_id,
+    job_dir, input_path); the job must then be passed to convert_job().
+    """
+    job_id = str(uuid.uuid4())
+    job_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    # Until the lock is taken the janitor only has JOB_MIN_AGE to go by,
+    # which a dir created a moment ago is well inside.
+    os.makedirs(job_dir, exist_ok=True)
+    lock = open(os.path.join(job_dir, JOB_LOCK_FILE), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    with job_locks_lock:
+        job_locks[job_dir] = lock
+    try:
+        input_path = os.path.join(job_dir, file.filename)
+        file.save(input_path)
+    except Exception:
+        end_job(job_dir)
+        raise
+    return job_id, job_dir, input_path
+
+def end_job(job_dir):
+    """Hands a job dir over to the janitor once it will no longer be converted."""
+    with job_locks_lock:
+        lock = job_locks.pop(job_dir, None)
+    if lock is None:
+        return
+    lock.close()  # releases the flock
+    try:
+        os.remove(os.path.join(job_dir, JOB_LOCK_FILE))
+    except FileNotFoundError:
+        pass  # the failed job's dir is gone already
+
+def job_in_progress(job_dir):
+    """Whether some server process still holds the job's conversion lock."""
+    try:
+        lock = open(os.path.join(job_dir, JOB_LOCK_FILE))
+    except FileNotFoundError:
+        return False
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+def convert_job(job_id, job_dir, input_path, queue_timeout=QUEUE_TIMEOUT):
+    """
+    Converts a saved deck, which must already have been admitted by the
+    scheduler, and returns (result, status code). The job dir is removed if
+    the conversion fails or no slot frees up within queue_timeout.
+    """
+    try:
+        filename = os.path.basename(input_path)
+        try:
+            scheduler.run(convert_to_pdf, input_path, job_dir, timeout=queue_timeout)
+        except QueueFull as e:
+            cleanup(job_dir)
+            return {"error": str(e), "retry_after": e.retry_after}, 503
+        except Exception as e:
+            print(f"Conversion failed for {filename}: {e}")
+            cleanup(job_dir)
+            return {"error": f"Conversion failed for {filename}"}, 500
+
+        output_filename = os.path.splitext(filename)[0] + '.pdf'
+        output_path = os.path.join(job_dir, output_filename)
+
+        if not os.path.exists(output_path):
+            cleanup(job_dir)
+            return {"error": "Converted file could not be found."}, 500
+
+        # On success, return info to build the download link on the client
+        return {
+            "success": True,
+            "job_id": job_id,
+            "output_filename": output_filename
+        }, 200
+    finally:
+        end_job(job_dir)
+
+class ZipSink:
+    """
+    Write-only file object for ZipFile. It has no seek or tell, so ZipFile
+    writes each entry's sizes in a trailing data descriptor and never needs to
+    go back: the archive can be sent as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def worth_deflating(path):
+    """PDFs are mostly compressed streams already; only deflate files where a sample shrinks."""
+    with open(path, 'rb') as f:
+        sample = f.read(64 * 1024)
+    return len(zlib.compress(sample, 1)) < len(sample) * (1 - ZIP_DEFLATE_MIN_SAVING)
+
+def stream_zip(entries):
+    """Yields a ZIP archive of (path, arcname) entries chunk by chunk, without touching disk."""
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w') as zipf:
+        for path, arcname in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_DEFLATED if worth_deflating(path) else zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zipf.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as dst:
+                while block := src.read(ZIP_CHUNK_BYTES):
+                    dst.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    # The central directory is written when the archive closes.
+    yield sink.drain()
+
+def job_usage(job_dir):
+    """Returns (bytes used, last modified) for a job dir."""
+    size = 0
+    modified = os.path.getmtime(job_dir)
+    for entry in os.scandir(job_dir):
+        stat = entry.stat(follow_symlinks=False)
+        size += stat.st_size
+        modified = max(modified, stat.st_mtime)
+    return size, modified
+
+janitor_stats = {'runs': 0, 'removed_jobs': 0, 'reclaimed_bytes': 0, 'jobs': 0, 'used_bytes': 0}
+
+def collect_job_dirs():
+    """
+    Removes expired job dirs, then the oldest remaining ones while uploads/
+    is over UPLOADS_MAX_BYTES. Jobs still converting, and finished ones
+    younger than JOB_MIN_AGE, are never touched.
+    """
+    jobs = []
+    for entry in os.scandir(app.config['UPLOAD_FOLDER']):
+        if entry.is_dir(follow_symlinks=False):
+            try:
+                jobs.append((entry.path, *job_usage(entry.path)))
+            except FileNotFoundError:
+                continue  # downloaded while we looked
+    jobs.sort(key=lambda job: job[2])  # oldest first
+
+    now = time.time()
+    used = sum(size for _, size, _ in jobs)
+    removed = reclaimed = 0
+    for job_dir, size, modified in jobs:
+        age = now - modified
+        if age < JOB_MIN_AGE:
+            break
+        if job_in_progress(job_dir):
+            continue
+        if age > JOB_TTL or used > UPLOADS_MAX_BYTES:
+            cleanup(job_dir)
+            used -= size
+            removed += 1
+            reclaimed += size
+
+    janitor_stats['runs'] += 1
+    janitor_stats['removed_jobs'] += removed
+    janitor_stats['reclaimed_bytes'] += reclaimed
+    janitor_stats['jobs'] = len(jobs) - removed
+    janitor_stats['used_bytes'] = used
+    if removed:
+        print(f"Janitor removed {removed} job dirs, reclaimed {reclaimed / (1024 * 1024):.1f} MB; "
+              f"uploads now at {used / (1024 * 1024):.1f} MB.")
+
+def run_janitor():
+    while True:
+        try:
+            collect_job_dirs()
+        except Exception as e:
+            print(f"Error during job dir cleanup: {e}")
+        time.sleep(JANITOR_INTERVAL)
+
+if SERVING:
+    threading.Thread(target=run_janitor, name='janitor', daemon=True).start()
+
 @app.route('/')
 def index():
     """Serves the main HTML page."""
@@ -48,38 +578,94 @@ def convert_single():
         return jsonify({"error": "No file selected"}), 400
 
     if file and allowed_file(file.filename):
-        job_id = str(uuid.uuid4())
-        job_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
-        os.makedirs(job_dir, exist_ok=True)
-        input_path = os.path.join(job_dir, file.filename)
-        file.save(input_path)
+        try:
+            scheduler.admit()
+        except QueueFull as e:
+            return queue_full_response(e)
+        try:
+            try:
+                job = save_upload(file)
+            except Exception:
+                scheduler.release()
+                raise
+            # This thread is held until the deck is converted, so it doesn't
+            # wait long for a slot; the client retries after a 503 instead.
+            return conversion_response(*convert_job(*job, queue_timeout=SINGLE_QUEUE_TIMEOUT))
+        finally:
+            scheduler.finish()
+    else:
+        return jsonify({"error": "Invalid file type."}), 400
 
+@app.route('/convert-batch', methods=['POST'])
+def convert_batch():
+    """
+    Converts many decks from one request. Each deck gets its own job, as with
+    /convert-single, and the response streams one JSON line per deck as soon
+    as it finishes: {"index", "filename"} plus the /convert-single result.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({"error": "No files selected"}), 400
+    # A batch is admitted whole, so it can't be bigger than the queue.
+    max_files = min(MAX_BATCH_FILES, scheduler.slots + scheduler.max_queued)
+    if len(files) > max_files:
+        return jsonify({"error": f"At most {max_files} files per batch."}), 400
+
+    try:
+        scheduler.admit(sum(1 for file in files if allowed_file(file.filename)))
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    rejected = []
+    pending = {}  # future -> (index, filename, job_dir)
+    for index, file in enumerate(files):
+        if not allowed_file(file.filename):
+            rejected.append({"index": index, "filename": file.filename, "error": "Invalid file type."})
+            continue
         try:
-            # Using 'libreoffice' is more standard than 'soffice'
-            subprocess.run(
-                ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', job_dir, input_path],
-                check=True, timeout=120
-            )
+            job_id, job_dir, input_path = save_upload(file)
         except Exception as e:
-            print(f"Conversion failed for {file.filename}: {e}")
-            cleanup(job_dir)
-            return jsonify({"error": f"Conversion failed for {file.filename}"}), 500
+            print(f"Could not save {file.filename}: {e}")
+            scheduler.release()
+            rejected.append({"index": index, "filename": file.filename, "error": "Upload could not be saved."})
+            continue
+        pending[batch_executor.submit(convert_job, job_id, job_dir, input_path)] = (index, file.filename, job_dir)
 
-        output_filename = os.path.splitext(file.filename)[0] + '.pdf'
-        output_path = os.path.join(job_dir, output_filename)
+    def generate():
+        for line in rejected:
+            yield json.dumps(line) + '\n'
+        for future in as_completed(list(pending)):
+            index, filename, _ = pending.pop(future)
+            result, _ = future.result()
+            yield json.dumps({"index": index, "filename": filename, **result}) + '\n'
 
-        if not os.path.exists(output_path):
-            cleanup(job_dir)
-            return jsonify({"error": "Converted file could not be found."}), 500
-        
-        # On success, return info to build the download link on the client
-        return jsonify({
-            "success": True, 
-            "job_id": job_id,
-            "output_filename": output_filename
-        })
-    else:
-        return jsonify({"error": "Invalid file type."}), 400
+    def abandon_rest():
+        # Decks still pending when the response closes were never reported,
+        # so the client went away: drop the queued ones and whatever the
+        # running ones produce.
+        for future, (_, _, job_dir) in pending.items():
+            if future.cancel():
+                scheduler.release()
+                end_job(job_dir)
+            # A failed conversion has removed its job dir already.
+            future.add_done_callback(lambda _, job_dir=job_dir: os.path.isdir(job_dir) and cleanup(job_dir))
+        pending.clear()
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    # Called when the response is closed, even if it never started streaming:
+    # the body may never be iterated at all if the client is already gone.
+    response.call_on_close(abandon_rest)
+    response.call_on_close(scheduler.finish)
+    return response
+
+@app.route('/conversions/stats', methods=['GET'])
+def get_conversion_stats():
+    # Each gunicorn worker has its own scheduler; these are this worker's.
+    return jsonify(scheduler.stats())
+
+@app.route('/uploads/stats', methods=['GET'])
+def get_upload_stats():
+    return jsonify({**janitor_stats, 'max_bytes': UPLOADS_MAX_BYTES, 'job_ttl': JOB_TTL})
 
 @app.route('/download/<job_id>/<filename>', methods=['GET'])
 def download_file(job_id, filename):
@@ -100,10 +686,8 @@ def download_file(job_id, filename):
 @app.route('/create-zip', methods=['POST'])
 def create_zip():
     """
-    This endpoint is now effectively replaced by the logic within the frontend 
-    to download multiple files individually, or a new batch endpoint would be needed.
-    For simplicity, let's stick to single file logic and a simplified batch download.
-    The most robust solution is to match the previous server's logic.
+    Streams a ZIP of the converted files of several jobs. The archive is built
+    on the fly as it is sent, and the jobs are cleaned up once it has been.
     """
     try:
         data = request.get_json()
@@ -111,31 +695,26 @@ def create_zip():
         if not job_ids_info:
             return jsonify({'error': 'No files selected for ZIP creation'}), 400
 
-        zip_job_id = str(uuid.uuid4())
-        zip_dir = os.path.join(app.config['UPLOAD_FOLDER'], zip_job_id)
-        os.makedirs(zip_dir)
-        zip_filename = f"converted_files_{zip_job_id}.zip"
-        zip_filepath = os.path.join(zip_dir, zip_filename)
-
-        with zipfile.ZipFile(zip_filepath, 'w') as zipf:
-            cleanup_dirs = []
-            for job_info in job_ids_info:
-                job_id = job_info.get('job_id')
-                output_filename = job_info.get('output_filename')
-                job_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
-                
-                converted_file_path = os.path.join(job_dir, output_filename)
-                if os.path.exists(converted_file_path):
-                    zipf.write(converted_file_path, arcname=output_filename)
-                    cleanup_dirs.append(job_dir)
-        
-        response = make_response(send_from_directory(zip_dir, zip_filename, as_attachment=True))
+        entries = []
+        cleanup_dirs = []
+        for job_info in job_ids_info:
+            job_id = job_info.get('job_id')
+            output_filename = job_info.get('output_filename')
+            job_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+
+            converted_file_path = os.path.join(job_dir, output_filename)
+            if os.path.exists(converted_file_path):
+                entries.append((converted_file_path, output_filename))
+                cleanup_dirs.append(job_dir)
+
+        zip_filename = f"converted_files_{uuid.uuid4()}.zip"
+        response = Response(stream_zip(entries), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{zip_filename}"'
 
         @response.call_on_close
         def after_request_cleanup():
             for d in set(cleanup_dirs): # Use set to avoid deleting the same dir twice
                 cleanup(d)
-            cleanup(zip_dir)
 
         return response
     except Exception as e: